@@ -0,0 +1,56 @@
+"""
+Measures how long `from espa_api_client import OrderTemplate` takes in a fresh
+interpreter, and which heavy dependencies it drags in. Exits with status 1 if the
+median import time exceeds the budget, or if any of the heavy modules were imported,
+so it can guard against regressions in the package's lazy imports.
+
+    python import_benchmark.py [budget_ms] [n_runs]
+"""
+import json
+import os
+import subprocess
+import sys
+from statistics import median
+
+HEAVY_MODULES = ('requests', 'urllib3', 'aiohttp', 'pandas', 'numpy', 'simplejson', 'sqlite3', 'geocoder')
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+PROBE = """
+import sys, json
+from time import perf_counter
+start = perf_counter()
+from espa_api_client import OrderTemplate
+seconds = perf_counter() - start
+print(json.dumps({"seconds": seconds, "heavy": [m for m in %r if m in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+
+def measure():
+    """ runs the probe in a fresh interpreter, returns (seconds, heavy modules imported) """
+    env = dict(os.environ, PYTHONPATH=PACKAGE_DIR + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    output = subprocess.check_output([sys.executable, "-c", PROBE], env=env)
+    result = json.loads(output.decode().strip().splitlines()[-1])
+    return result["seconds"], result["heavy"]
+
+
+def main(budget_ms=50, n_runs=10):
+    measure()   # the first run writes bytecode caches, don't count it
+    runs = [measure() for _ in range(n_runs)]
+    import_ms = 1000 * median(seconds for seconds, _ in runs)
+    heavy = sorted(set(m for _, modules in runs for m in modules))
+
+    print("import time    {0:.1f}ms (median of {1}, budget {2}ms)".format(import_ms, n_runs, budget_ms))
+    print("heavy imports  {0}".format(", ".join(heavy) or "none"))
+
+    failed = False
+    if import_ms > budget_ms:
+        print("FAIL: import time is over budget")
+        failed = True
+    if heavy:
+        print("FAIL: heavy modules imported eagerly")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(*[int(a) for a in sys.argv[1:]]))
@@ -0,0 +1,65 @@
+"""
+Compares the per-call cost of the module level requests.get (a new connection
+for every call) against a BaseClient using a pooled keep-alive session. Both run
+against a local stub of the espa api, so only connection handling differs.
+
+    python session_benchmark.py [n_calls]
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import requests
+from espa_api_client.Clients import BaseClient
+from espa_api_client.Sessions import build_session
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # required for keep-alive
+    disable_nagle_algorithm = True  # headers and body go out in separate sends, don't wait for delayed acks
+
+    def do_GET(self):
+        body = json.dumps({"email": "stub@localhost", "orderid": self.path}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def main(n_calls=500):
+    server = StubServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host = "http://127.0.0.1:{0}".format(server.server_address[1])
+
+    client = BaseClient(auth=("stub", "stub"), host=host, session=build_session())
+    url = client._url("order-status", "stub-order")
+
+    start = time.perf_counter()
+    for _ in range(n_calls):
+        requests.get(url, auth=client.auth, headers=client.headers)
+    unpooled = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(n_calls):
+        client.get_order_status("stub-order")
+    pooled = time.perf_counter() - start
+
+    server.shutdown()
+    print("requests.get   {0:.2f}ms/call".format(1000 * unpooled / n_calls))
+    print("pooled session {0:.2f}ms/call".format(1000 * pooled / n_calls))
+    print("speedup        {0:.2f}x".format(unpooled / pooled))
+
+
+if __name__ == "__main__":
+    import sys
+    main(*[int(a) for a in sys.argv[1:]])
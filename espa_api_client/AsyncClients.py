@@ -0,0 +1,349 @@
+import asyncio
+import os
+import warnings
+from contextlib import closing
+from functools import partial
+from time import time
+import simplejson as json
+from espa_api_client.conf import API_HOST_URL, API_VERSION, HEADERS, TIMEOUT, POOL_MAXSIZE, MAX_WORKERS
+from espa_api_client.Exceptions import *
+from espa_api_client.Clients import BaseClient
+from espa_api_client.Sessions import iter_window
+from espa_api_client.Downloaders import BaseDownloader, member_filter
+from espa_api_client.OrderState import ItemStateTable
+from espa_api_client.Schedulers import AdaptiveScheduler, count_statuses, FINISHED_STATUSES
+
+try:
+    import aiohttp
+except ImportError:  # aiohttp is optional, only the async clients need it
+    aiohttp = None
+
+
+class AsyncResponse(object):
+    """
+    The finished body of an api response. Mirrors the parts of requests.Response the
+    clients use, so .json() works the same as with the blocking clients.
+    """
+
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class AsyncBaseClient(object):
+    """
+    asyncio version of BaseClient, with the same one to one bindings of api calls.
+    Every binding is a coroutine which returns an AsyncResponse. Requires aiohttp.
+
+    Use it as an async context manager, which checks authentication and closes the
+    connection pool on exit:
+
+        async with AsyncClient(auth) as client:
+            order = (await client.get_order(order_id)).json()
+    """
+
+    _url = BaseClient._url
+
+    def __init__(self, auth=None, session=None, timeout=TIMEOUT, host=API_HOST_URL, limit=POOL_MAXSIZE):
+        """
+        :param auth:        tuple of (username, password) strings.
+        :param session:     optional aiohttp.ClientSession to use for every call. It is left
+                            open for the caller to close, only a session the client creates
+                            itself is closed by close().
+        :param timeout:     seconds to wait per request, or a (connect, read) tuple
+        :param host:        api host url, may be pointed at a local stub server for testing
+        :param limit:       maximum number of open connections, when no session is given
+        """
+        if aiohttp is None:
+            raise ImportError("The async clients require aiohttp, install it with 'pip install aiohttp'")
+
+        if auth is None:
+            username = str(input("espa username:"))
+            password = str(input("espa password:"))
+            auth = (username, password)
+
+        self.auth = auth
+        self.session = session
+        self._owns_session = False
+        self.timeout = timeout
+        self.limit = limit
+        self.headers = HEADERS
+        self.host = host
+        self.version = API_VERSION
+        self.verbose = False
+
+    async def __aenter__(self):
+        try:
+            authenticated = await self._test_auth()
+        except BaseException:
+            await self.close()
+            raise
+        if not authenticated:
+            await self.close()
+            raise AuthError("Failed to authenticate at https://espa.cr.usgs.gov/login")
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def close(self):
+        """ closes the session and its pooled connections, if the client created it """
+        if self._owns_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+            self._owns_session = False
+
+    def _session(self):
+        """ returns the session, creating it on first use (it must be created inside the event loop) """
+        if self.session is None:
+            if isinstance(self.timeout, tuple):
+                connect, read = self.timeout
+            else:
+                connect, read = self.timeout, self.timeout
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit),
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=connect, sock_read=read))
+            self._owns_session = True
+        return self.session
+
+    async def _test_auth(self):
+        """ checks that authentication info works """
+        user = await self.get_user()
+        try:
+            return "Invalid username/password" not in user.json().values()
+        except ValueError:
+            warnings.warn("ESPA Service appears to be offline! Response: {}".format(user.text))
+            return True
+
+    async def _get(self, *args):
+        """ wraps session.get with url assembly from args """
+        async with self._session().get(self._url(*args), auth=aiohttp.BasicAuth(*self.auth),
+                                       headers=self.headers) as r:
+            return AsyncResponse(r.status, await r.text())
+
+    async def _post(self, *args, data=None):
+        """ wraps session.post with url assembly from args """
+        async with self._session().post(self._url(*args), auth=aiohttp.BasicAuth(*self.auth),
+                                        headers=self.headers, data=data) as r:
+            return AsyncResponse(r.status, await r.text())
+
+    async def get_operations(self):
+        return await self._get()
+
+    async def get_user(self):
+        return await self._get('user')
+
+    async def get_orders_list(self, email=None):
+        return await self._get('list-orders', email)
+
+    async def get_order(self, order_id):
+        return await self._get('order', order_id)
+
+    async def get_order_status(self, order_id):
+        return await self._get('order-status', order_id)
+
+    async def get_order_schema(self):
+        return await self._get('order-schema')
+
+    async def get_item_status(self, order_num, item_num=None):
+        return await self._get('item-status', order_num, item_num)
+
+    async def get_available_products(self, product_id=None):
+        return await self._get('available-products', product_id)
+
+    async def get_projections(self):
+        return await self._get('projections')
+
+    async def post_order(self, order_content):
+        if isinstance(order_content, dict):
+            order_content = json.dumps(order_content)
+        return await self._post('order', data=order_content)
+
+
+class AsyncClient(AsyncBaseClient):
+    """
+    asyncio version of Client. get_active_orders, get_items_by_status and
+    download_order_gen are async generators, so many orders can be tracked
+    and downloaded on one event loop.
+    """
+
+    def __init__(self, auth=None, max_workers=MAX_WORKERS, **kwargs):
+        """
+        :param auth:        tuple of (username, password) strings.
+        :param max_workers: maximum number of concurrent api calls made by bulk methods
+        :param kwargs:      keyword arguments for AsyncBaseClient
+        """
+        self.max_workers = max_workers
+        super(AsyncClient, self).__init__(auth, **kwargs)
+
+    async def iter_orders(self, order_ids, max_workers=None):
+        """
+        async generator of (order_id, order_json) tuples for every input order id, in the
+        same order as the input, with at most max_workers requests in flight.
+        """
+        if max_workers is None:
+            max_workers = self.max_workers
+        with closing(iter_window(order_ids, lambda order_id: asyncio.ensure_future(self.get_order(order_id)),
+                                 max_workers)) as window:
+            for order_id, task in window:
+                yield order_id, (await task).json()
+
+    async def get_active_orders(self):
+        """
+        async generator of orders which have not yet been purged. orders are listed
+        newest first, so fetching stops at the first purged order.
+        """
+        orders = (await self.get_orders_list()).json()["orders"]
+        async for order_id, order in self.iter_orders(orders):
+            if order["status"] == "purged":
+                break
+            yield order_id
+
+    async def _order_items(self, order_id):
+        """ returns the list of all items in an order, from a single item-status call """
+        items = (await self.get_item_status(order_id)).json()
+        if "orderid" in items.keys():
+            items = items["orderid"][order_id]
+        if isinstance(items, list):
+            return items
+        return []
+
+    async def get_items_by_status(self, order_id=None, status=None):
+        """
+        async generator of items with input status. Use status = None to get all
+        items regardless of status, and order_id = None to check every active order.
+        """
+        if order_id is None:
+            async for order_id in self.get_active_orders():
+                async for item in self.get_items_by_status(order_id=order_id, status=status):
+                    yield item
+        else:
+            for item in await self._order_items(order_id):
+                if status is None or item["status"] == status:
+                    yield item
+
+    async def _download(self, source, dest, downloader):
+        """
+        streams source to '{dest}.part' in downloader.chunk_size chunks, resuming with a
+        Range request and backing off between attempts, with the same steps as
+        BaseDownloader._stream around the request.
+        """
+        trynum = 0
+        while True:
+            part, offset, headers = downloader._resume_point(dest)
+            try:
+                async with self._session().get(source, headers=headers) as r:
+                    if r.status == 416:
+                        return downloader._finish_unsatisfiable(part, dest, offset, r.headers)
+                    r.raise_for_status()
+                    expected, write_mode = downloader._expected_size(r.status, r.headers)
+                    with open(part, write_mode) as f:
+                        async for chunk in r.content.iter_chunked(downloader.chunk_size):
+                            f.write(chunk)
+
+                return downloader._finish_part(source, part, dest, expected)
+
+            except (aiohttp.ClientError, asyncio.TimeoutError, IOError, IncompleteDownloadError) as e:
+                await asyncio.sleep(downloader._backoff(source, e, trynum))
+                trynum += 1
+
+    async def download_item(self, item, downloader=None, mode='w', cleanup=True, stream_extract=False,
+                            include=None, exclude=None, predicate=None):
+        """
+        downloads and extracts a single item with the given downloader's destinations and settings.
+        Extraction runs in the default executor so it doesn't block the event loop.
+        With stream_extract, the whole streamed extraction of BaseDownloader.download() runs
+        in the executor instead, on the downloader's own (blocking) session.
+        :return: tuple(destination path (str), new_download? (bool))
+        """
+        if downloader is None:
+            downloader = BaseDownloader('espa_downloads')
+
+        source = item['product_dload_url']
+        raw_dest = downloader._raw_destination_mapper(source)
+        ext_dest = downloader._ext_destination_mapper(raw_dest)
+        keep = member_filter(include, exclude, predicate)
+        loop = asyncio.get_running_loop()
+        if stream_extract and raw_dest.endswith(".tar.gz") and (not os.path.exists(ext_dest) or mode == 'w+'):
+            await loop.run_in_executor(None, partial(downloader._stream_extract, source, ext_dest, keep=keep))
+            fresh = True
+        elif not os.path.exists(ext_dest) or mode == 'w+':
+            if mode == 'w+' and os.path.exists(raw_dest + ".part"):
+                os.remove(raw_dest + ".part")
+            await self._download(source, raw_dest, downloader)
+            await loop.run_in_executor(None, downloader._extract, raw_dest, ext_dest, keep)
+            fresh = True
+        else:
+            print("Found: {0}, Use mode='w+' to force rewrite".format(ext_dest))
+            fresh = False
+        if cleanup and os.path.exists(raw_dest):
+            os.remove(raw_dest)
+        return ext_dest, fresh
+
+    async def download_order_gen(self, order_id, downloader=None, sleep_time=300, timeout=86400, workers=4,
+                                 min_sleep_time=30, scheduler=None, state=None, **dlkwargs):
+        """
+        async generator version of Client.download_order_gen. Polls the order once per cycle on
+        an AdaptiveScheduler, downloads newly completed items with up to `workers` downloads at
+        once, and yields (path, fresh) tuples in the order the downloads finish.
+
+        :param order_id:            order name
+        :param downloader:          optional BaseDownloader (or child) giving destinations and settings
+        :param sleep_time:          maximum number of seconds to wait between checking order status
+        :param timeout:             maximum number of seconds to run program
+        :param workers:             number of concurrent downloads
+        :param min_sleep_time:      minimum number of seconds to wait between checking order status
+        :param scheduler:           optional Schedulers.AdaptiveScheduler to pick wait times
+        :param state:               optional OrderState.ItemStateTable, or path to a json file
+                                    to persist one to.
+        :param dlkwargs:            keyword arguments for download_item()
+        """
+        if downloader is None:
+            downloader = BaseDownloader('espa_downloads')
+        if scheduler is None:
+            scheduler = AdaptiveScheduler(min(min_sleep_time, sleep_time), sleep_time)
+        if not isinstance(state, ItemStateTable):
+            state = ItemStateTable(order_id, path=state)
+
+        limiter = asyncio.Semaphore(workers)
+
+        async def download(item):
+            async with limiter:
+                return item['name'], await self.download_item(item, downloader, **dlkwargs)
+
+        starttime = time()
+        running = set()
+        complete = False
+        try:
+            while not complete and time() - starttime <= timeout:
+                items = await self._order_items(order_id)
+                active = [item for item in items if item['status'] not in FINISHED_STATUSES]
+                complete = len(active) < 1
+                wake_time = time() if complete else time() + scheduler.update(count_statuses(items))
+                print("{0}: {1} active items".format(order_id, len(active)))
+
+                for item in state.update(items):
+                    state.mark_pending(item['name'])
+                    running.add(asyncio.ensure_future(download(item)))
+
+                # yield finished downloads until the next poll, or until all are done once complete
+                while running:
+                    wait = None if complete else max(0, wake_time - time())
+                    finished, running = await asyncio.wait(running, timeout=wait,
+                                                           return_when=asyncio.FIRST_COMPLETED)
+                    if not finished:
+                        break
+                    for task in finished:
+                        name, result = task.result()
+                        state.mark_done(name, result[0])
+                        yield result
+                state.save()
+                if not complete:
+                    await asyncio.sleep(max(0, wake_time - time()))
+        finally:
+            for task in running:
+                task.cancel()
+            state.save()
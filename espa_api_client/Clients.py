@@ -1,12 +1,20 @@
 import requests
 import simplejson as json
 from simplejson.scanner import JSONDecodeError
-from time import sleep
+from time import sleep, time
 from datetime import datetime
 import warnings
-from espa_api_client.conf import API_HOST_URL, API_VERSION, HEADERS
+import os
+from collections import deque, OrderedDict
+from contextlib import closing
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from espa_api_client.conf import API_HOST_URL, API_VERSION, HEADERS, TIMEOUT, MAX_WORKERS
 from espa_api_client.Exceptions import *
-from espa_api_client.Downloaders import BaseDownloader
+from espa_api_client.Downloaders import BaseDownloader, ParallelDownloader
+from espa_api_client.Sessions import get_shared_session, iter_window
+from espa_api_client.Schedulers import AdaptiveScheduler, count_statuses
+from espa_api_client.OrderState import ItemStateTable
 
 
 class ServiceOfflineError(Exception):
@@ -19,11 +27,21 @@ class BaseClient(object):
     to each of its very simple functions. All external functions return
     simple requests response objects, use .json() method to get more human
     readable response data
+
+    All calls go through one pooled keep-alive session. By default this is the
+    process wide session from Sessions.get_shared_session(), so every client in
+    the process reuses the same open connections.
     """
 
-    def __init__(self, auth=None):
+    def __init__(self, auth=None, session=None, timeout=TIMEOUT, host=API_HOST_URL, **pool_kwargs):
         """
-        :param auth: tuple of (username, password) strings.
+        :param auth:        tuple of (username, password) strings.
+        :param session:     optional requests.Session to use for every call. If None, the
+                            shared session for the given pool_kwargs is used.
+        :param timeout:     seconds to wait per request, or a (connect, read) tuple
+        :param host:        api host url, may be pointed at a local stub server for testing
+        :param pool_kwargs: keyword arguments for Sessions.build_session(), such as
+                            pool_maxsize or keep_alive.
         """
         if auth is None:
             username = str(input("espa username:"))
@@ -32,8 +50,13 @@ class BaseClient(object):
         else:
             self.auth = auth
 
+        if session is None:
+            session = get_shared_session(**pool_kwargs)
+
+        self.session = session
+        self.timeout = timeout
         self.headers = HEADERS
-        self.host = API_HOST_URL
+        self.host = host
         self.version = API_VERSION
         self.verbose = False  # TODO: verbose dev flag, remove or expose
 
@@ -65,18 +88,20 @@ class BaseClient(object):
         return url
 
     def _get(self, *args):
-        """ wraps requests.get with url assembly from args, plus auth and header spec """
-        r = requests.get(url=self._url(*args),
-                         auth=self.auth,
-                         headers=self.headers)
+        """ wraps session.get with url assembly from args, plus auth and header spec """
+        r = self.session.get(url=self._url(*args),
+                             auth=self.auth,
+                             headers=self.headers,
+                             timeout=self.timeout)
         return r
 
     def _post(self, *args, data=None):
-        """ wraps requests.post with url assembly from args, plus auth and header spec """
-        r = requests.post(url=self._url(*args),
-                          auth=self.auth,
-                          headers=self.headers,
-                          data=data)
+        """ wraps session.post with url assembly from args, plus auth and header spec """
+        r = self.session.post(url=self._url(*args),
+                              auth=self.auth,
+                              headers=self.headers,
+                              data=data,
+                              timeout=self.timeout)
         return r
 
     def get_operations(self):
@@ -118,8 +143,17 @@ class Client(BaseClient):
      filtering responses from the native API calls and expressing them
      a little more usefully.
     """
-    def __init__(self, auth=None):
-        super(Client, self).__init__(auth)
+    def __init__(self, auth=None, max_workers=MAX_WORKERS, cache=None, **kwargs):
+        """
+        :param auth:        tuple of (username, password) strings.
+        :param max_workers: maximum number of concurrent api calls made by bulk methods
+        :param cache:       optional OrderCache instance. When given, duplicate note
+                            detection only fetches orders which are new or stale.
+        :param kwargs:      keyword arguments for BaseClient
+        """
+        self.max_workers = max_workers
+        self.cache = cache
+        super(Client, self).__init__(auth, **kwargs)
         try:
             self.schema = self.get_order_schema().json()
         except:  # happens when server is down
@@ -129,15 +163,41 @@ class Client(BaseClient):
         """ lists available sensors from the order schema """
         return sorted(self.schema["oneormoreobjects"])
 
+    def iter_orders(self, order_ids, max_workers=None):
+        """
+        generator of (order_id, order_json) tuples for every input order id, in the same
+        order as the input. Orders are fetched concurrently with at most max_workers
+        requests in flight, and nothing further is fetched once the caller stops iterating.
+
+        :param order_ids:   iterable of order ids
+        :param max_workers: number of concurrent requests, defaults to self.max_workers
+        """
+        if max_workers is None:
+            max_workers = self.max_workers
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            with closing(iter_window(order_ids, partial(executor.submit, self.get_order), max_workers)) as window:
+                for order_id, future in window:
+                    yield order_id, future.result().json()
+
+    def _active_order_records(self):
+        """
+        generator of (order_id, order_json) tuples for orders which have not yet been purged.
+        orders are listed newest first, so fetching stops at the first purged order.
+        """
+        for order_id, order in self.iter_orders(self.get_orders_list().json()["orders"]):
+            if order["status"] == "purged":
+                break
+            yield order_id, order
+
     def get_active_orders(self):
         """
         generator of orders which have not yet been purged.
         orders are stored in a list where the newest are up top, therefore once
         we hit the first purged order, every order under it will also be purged.
         """
-        for order in self.get_orders_list().json()["orders"]:
-            if self.get_order(order).json()["status"] != "purged":
-                yield order
+        for order_id, _ in self._active_order_records():
+            yield order_id
 
     def get_items_by_status(self, order_id=None, status=None):
         """
@@ -150,16 +210,21 @@ class Client(BaseClient):
             for order_id in self.get_active_orders():
                 yield from self.get_items_by_status(order_id=order_id, status=status)
         else:
-            items = self.get_item_status(order_id).json()
-            if "orderid" in items.keys():  # if this funciton is nested, need to parse more
-                items = items["orderid"][order_id]
-            if isinstance(items, list):
-                for item in items:
-                    if status is None:
+            for item in self._order_items(order_id):
+                if status is None:
+                    yield item
+                else:
+                    if item["status"] == status:
                         yield item
-                    else:
-                        if item["status"] == status:
-                            yield item
+
+    def _order_items(self, order_id):
+        """ returns the list of all items in an order, from a single item-status call """
+        items = self.get_item_status(order_id).json()
+        if "orderid" in items.keys():  # if this funciton is nested, need to parse more
+            items = items["orderid"][order_id]
+        if isinstance(items, list):
+            return items
+        return []
 
     def list_order_notes(self, active_only=True, verbose=False):
         """
@@ -168,11 +233,11 @@ class Client(BaseClient):
         order
         """
         if active_only:
-            order_names = self.get_active_orders()
+            orders = self._active_order_records()
         else:
-            order_names = self.get_orders_list().json()["orders"]
+            orders = self.iter_orders(self.get_orders_list().json()["orders"])
 
-        order_notes = [(o, self.get_order(o).json()['note']) for o in order_names]
+        order_notes = [(o, order['note']) for o, order in orders]
         if verbose:
             if active_only:
                 print("Active Orders / Notes")
@@ -183,24 +248,68 @@ class Client(BaseClient):
 
         return order_notes
 
-    def find_orders_with_note(self, search_note, active_only=True):
+    def refresh_order_cache(self, active_only=True):
+        """
+        Fetches every order which is missing from self.cache or has gone stale, and
+        stores its note and status. Orders are listed newest first, so with active_only
+        nothing below the first purged order is fetched, and every order from there on
+        is taken to be purged whatever its cached status.
+
+        :return: list of the order ids on the account, newest first. With active_only,
+                 only those above the first purged order.
+        """
+        order_ids = self.get_orders_list().json()["orders"]
+        boundary = len(order_ids)
+        stale = []
+        for i, order_id in enumerate(order_ids):
+            record = self.cache.get(order_id)
+            if active_only and record is not None and record.status == "purged":
+                boundary = i
+                break
+            if not self.cache.is_fresh(order_id):
+                stale.append(order_id)
+
+        for order_id, order in self.iter_orders(stale):
+            self.cache.put(order_id, order["note"], order["status"])
+            if active_only and order["status"] == "purged":
+                boundary = min(boundary, order_ids.index(order_id))
+                break
+        return order_ids[:boundary]
+
+    def find_orders_with_note(self, search_note, active_only=True, exact=False):
         """
         Finds an order with a note which CONTAINS the search note. An
         input note of "my-order" will return an order with note
         "my-order-2016-01-01".
 
-        not sure if this behavior is desired or not.
+        not sure if this behavior is desired or not. Use exact=True to
+        only match identical notes.
+        """
+        return self.find_orders_with_notes([search_note], active_only, exact)[search_note]
+
+    def find_orders_with_notes(self, search_notes, active_only=True, exact=False):
         """
-        return_list = []
+        find_orders_with_note() for many notes at once, listing the orders on the
+        account only once.
+        :return: dict of search note -> list of matching order ids, newest first
+        """
+        if self.cache is not None:
+            order_ids = self.refresh_order_cache(active_only)
+            found = {}
+            for search_note in search_notes:
+                matches = self.cache.find(search_note, exact=exact, active_only=active_only)
+                found[search_note] = [o for o in order_ids if o in matches]
+            return found
+
         order_notes = self.list_order_notes(active_only=active_only)
-        for order_name, note in order_notes:
-            if note:
-                if search_note in note:
-                    return_list.append(order_name)
-        return return_list
+        found = {}
+        for search_note in search_notes:
+            found[search_note] = [order_name for order_name, note in order_notes if note and
+                                  (note == search_note or (not exact and search_note in note))]
+        return found
 
     def safe_post_order(self, order_id, active_only=True):
-        """12222
+        """
         exactly as .post_order() of the parent class, but will first
         check for existing orders with a common 'note' field. If one or more
         are found, function returns a response that looks like a fresh
@@ -211,11 +320,26 @@ class Client(BaseClient):
 
             orders_with_same_note = self.find_orders_with_note(new_note, active_only)
             if len(orders_with_same_note) > 0:
-                print("Found duplicate past order(s): {0}".format(orders_with_same_note))
-                print("Returning {0}".format({"orderid": orders_with_same_note[0]}))
-                return {"orderid": orders_with_same_note[0]}
+                return self._existing_order_response(orders_with_same_note)
             else:
-                return self.post_order(order_id).json()
+                return self.post_new_order(order_id)
+
+    @staticmethod
+    def _existing_order_response(order_ids):
+        """ the response safe_post_order() returns for a note which is already in use """
+        print("Found duplicate past order(s): {0}".format(order_ids))
+        print("Returning {0}".format({"orderid": order_ids[0]}))
+        return {"orderid": order_ids[0]}
+
+    def post_new_order(self, order_content):
+        """
+        posts an order already known to be new, without checking for duplicate notes,
+        and records it in self.cache. Returns the response json.
+        """
+        response = self.post_order(order_content).json()
+        if self.cache is not None and "orderid" in response:
+            self.cache.put(response["orderid"], order_content["note"], "ordered")
+        return response
 
     def _error_items(self, order, verbose=False):
         """ returns list of items with status 'error', can print summary. """
@@ -227,12 +351,13 @@ class Client(BaseClient):
                     print('\t', item["name"], item["note"])
         return error_items
 
-    def _active_items(self, order_id, verbose=False):
+    def _active_items(self, order_id, verbose=False, items=None):
         """
         returns list of items with active statuses, (not complete or error).
-        can print summary if verbose is True.
+        can print summary if verbose is True. Pass items from _order_items()
+        to skip fetching them again.
         """
-        all_items = self.get_item_status(order_id).json()["orderid"][order_id]
+        all_items = self._order_items(order_id) if items is None else items
         active_items = [item for item in all_items
                         if item['status'] != 'complete' and
                         item['status'] != 'error' and
@@ -244,12 +369,15 @@ class Client(BaseClient):
                     print('\t', item["name"], item["status"])
         return active_items
 
-    def _complete_items(self, order, verbose=False):
+    def _complete_items(self, order, verbose=False, items=None):
         """
         checks order for completed items (ready for download) and then returns
-        a list of completed items
+        a list of completed items. Pass items from _order_items() to skip
+        fetching them again.
         """
-        complete_items = list(self.get_items_by_status(order, "complete"))
+        if items is None:
+            items = self._order_items(order)
+        complete_items = [item for item in items if item["status"] == "complete"]
         if verbose:
             if len(complete_items) > 0:
                 print("Completed items ({0})".format(len(complete_items)))
@@ -272,43 +400,217 @@ class Client(BaseClient):
         if url is not None:
             return downloader.download(url, **dlkwargs)
 
-    def download_order_gen(self, order_id, downloader=None, sleep_time=300, timeout=86400, **dlkwargs):
+    def download_order_gen(self, order_id, downloader=None, sleep_time=300, timeout=86400, workers=None,
+                           min_sleep_time=30, scheduler=None, state=None, **dlkwargs):
         """
         This function is a generator that yields the results from the input downloader classes
         download() method. This is a generator mostly so that data pipeline functions that operate
         upon freshly downloaded files may immediately get started on them.
 
+        With workers (or a ParallelDownloader as the downloader) completed items are downloaded
+        in parallel, and results are yielded in the order the downloads finish, including
+        while waiting between status checks.
+
+        The order status is checked once per cycle. The wait between checks is chosen by an
+        AdaptiveScheduler: min_sleep_time after item statuses change, growing up to sleep_time
+        while nothing changes.
+
+        Each item is only downloaded (and yielded) once, on the first cycle it is seen complete.
+        Pass a state table, or the path of a json file to keep it in, to remember downloaded
+        items across restarts. Items recorded as done in it are not yielded again.
+
         :param order_id:            order name
         :param downloader:          optional downloader for tiles. child of BaseDownloader class
                                     of a Downloaders.BaseDownloader or child class
-        :param sleep_time:          number of seconds to wait between checking order status
+        :param sleep_time:          maximum number of seconds to wait between checking order status
         :param timeout:             maximum number of seconds to run program
+        :param workers:             number of parallel downloads, None downloads one at a time.
+        :param min_sleep_time:      minimum number of seconds to wait between checking order status
+        :param scheduler:           optional Schedulers.AdaptiveScheduler to pick wait times
+        :param state:               optional OrderState.ItemStateTable, or path to a json file
+                                    to persist one to.
         :param dlkwargs:            keyword arguments for downloader.download() method.
         :returns:                   yields values from the input downloader.download() method.
         """
 
-        def is_complete():
-            return len(self._active_items(order_id, verbose=True)) < 1
-
         complete = False
         reached_timeout = False
         starttime = datetime.now()
 
         if downloader is None:
             downloader = BaseDownloader('espa_downloads')
+        if scheduler is None:
+            scheduler = AdaptiveScheduler(min(min_sleep_time, sleep_time), sleep_time)
 
-        while not complete and not reached_timeout:
-            # wait a while before the next ping and check timeout condition
-            elapsed_time = (datetime.now() - starttime).seconds
-            reached_timeout = elapsed_time > timeout
-            print("Elapsed time is {0}m".format(elapsed_time / 60.0))
+        if not isinstance(state, ItemStateTable):
+            state = ItemStateTable(order_id, path=state)
 
-            # check order completion status, and list all items which ARE complete
-            complete_items = self._complete_items(order_id, verbose=False)
+        pool = None
+        if isinstance(downloader, ParallelDownloader):
+            pool = downloader
+        elif workers is not None:
+            pool = ParallelDownloader(downloader, workers)
 
-            for c in complete_items:
-                yield self.download_item(c, downloader, **dlkwargs)
+        try:
+            while not complete and not reached_timeout:
+                # wait a while before the next ping and check timeout condition
+                elapsed_time = (datetime.now() - starttime).seconds
+                reached_timeout = elapsed_time > timeout
+                print("Elapsed time is {0}m".format(elapsed_time / 60.0))
+
+                # check order status once, and list items which have completed since the last check
+                items = self._order_items(order_id)
+                new_items = state.update(items)
+                active_items = self._active_items(order_id, verbose=True, items=items)
+                complete = len(active_items) < 1
+
+                wait = 0
+                if not complete:
+                    wait = scheduler.update(count_statuses(items))
+                    remaining = scheduler.estimate_remaining(len(active_items))
+                    if remaining is not None:
+                        print("Estimated time remaining is {0:.1f}m".format(remaining / 60.0))
+                wake_time = time() + wait
+
+                for c in new_items:
+                    if pool is None:
+                        result = self.download_item(c, downloader, **dlkwargs)
+                        state.mark_done(c['name'], result[0])
+                        yield result
+                    else:
+                        state.mark_pending(c['name'])
+                        pool.submit(c['product_dload_url'], tag=c['name'], **dlkwargs)
+                        for name, result in pool.iter_completed(timeout=0):
+                            state.mark_done(name, result[0])
+                            yield result
+
+                if pool is not None:
+                    # keep yielding finished downloads while waiting for the next ping
+                    for name, result in pool.iter_completed(timeout=None if complete else wake_time - time()):
+                        state.mark_done(name, result[0])
+                        yield result
+                state.save()
+                if not complete:
+                    sleep(max(0, wake_time - time()))
+        finally:
+            state.save()
+            if pool is not None and pool is not downloader:
+                pool.close(cancel=True)
+
+    def download_orders_gen(self, order_ids, downloader=None, workers=4, per_order_limit=None, sleep_time=300,
+                            timeout=86400, min_sleep_time=30, state_dir=None, **dlkwargs):
+        """
+        Downloads many orders at once with one shared pool of download workers. All orders are
+        polled from a single loop (each on its own AdaptiveScheduler), and completed items are
+        handed to the workers round robin across orders, so no single order can occupy every
+        worker while others have items waiting.
+
+        :param order_ids:           list of order names
+        :param downloader:          optional downloader for tiles, a BaseDownloader (or child)
+                                    or a ParallelDownloader instance
+        :param workers:             number of parallel downloads shared by all orders
+        :param per_order_limit:     maximum downloads in flight for any one order. Defaults to
+                                    an even share of workers among orders with items waiting.
+        :param sleep_time:          maximum number of seconds to wait between checking an orders status
+        :param timeout:             maximum number of seconds to run program
+        :param min_sleep_time:      minimum number of seconds to wait between checking an orders status
+        :param state_dir:           optional folder to persist each orders ItemStateTable in,
+                                    as '{order_id}.json'
+        :param dlkwargs:            keyword arguments for downloader.download() method.
+        :returns:                   yields (order_id, downloader.download() result) tuples in
+                                    the order downloads finish. A failed item download doesn't
+                                    stop the other orders, it is printed and recorded in the
+                                    orders ItemStateTable.failed, and retried if its order is
+                                    polled again (while the order is still running).
+        """
 
-            complete = is_complete()
-            if not complete:
-                sleep(sleep_time)
+        class OrderTrack(object):
+            """ what the loop knows about one order """
+            def __init__(self, order_id):
+                path = None if state_dir is None else os.path.join(state_dir, "{0}.json".format(order_id))
+                self.state = ItemStateTable(order_id, path=path)
+                self.scheduler = AdaptiveScheduler(min(min_sleep_time, sleep_time), sleep_time)
+                self.backlog = deque()
+                self.in_flight = 0
+                self.next_poll = 0
+                self.complete = False
+
+        if downloader is None:
+            downloader = BaseDownloader('espa_downloads')
+        pool = downloader if isinstance(downloader, ParallelDownloader) else ParallelDownloader(downloader, workers)
+        if state_dir is not None and not os.path.exists(state_dir):
+            os.makedirs(state_dir)
+
+        tracks = OrderedDict((order_id, OrderTrack(order_id)) for order_id in order_ids)
+        starttime = time()
+
+        def poll_due_orders():
+            now = time()
+            due = [o for o, t in tracks.items() if not t.complete and t.next_poll <= now]
+            if not due:
+                return
+            with ThreadPoolExecutor(max_workers=min(len(due), self.max_workers)) as executor:
+                for order_id, items in zip(due, executor.map(self._order_items, due)):
+                    track = tracks[order_id]
+                    for item in track.state.update(items):
+                        track.state.mark_pending(item['name'])
+                        track.backlog.append(item)
+                    track.state.save()
+                    active = len(self._active_items(order_id, items=items))
+                    track.complete = active < 1
+                    track.next_poll = time() + track.scheduler.update(count_statuses(items))
+                    print("{0}: {1} active items, {2} waiting for download".format(
+                        order_id, active, len(track.backlog) + track.in_flight))
+
+        def on_error(tag, error):
+            order_id, name = tag
+            track = tracks[order_id]
+            track.in_flight -= 1
+            track.state.mark_failed(name, error)
+            print("{0}: download of {1} failed, {2}".format(order_id, name, error))
+            dispatch()
+
+        def dispatch():
+            """ hands waiting items to free workers, one order at a time in turn """
+            waiting = [t for t in tracks.values() if t.backlog or t.in_flight]
+            limit = per_order_limit or max(1, workers // max(1, len(waiting)))
+            submitted = True
+            while submitted and pool.pending < workers:
+                submitted = False
+                for order_id, track in tracks.items():
+                    if pool.pending >= workers:
+                        break
+                    if track.backlog and track.in_flight < limit:
+                        item = track.backlog.popleft()
+                        track.in_flight += 1
+                        pool.submit(item['product_dload_url'], tag=(order_id, item['name']), **dlkwargs)
+                        submitted = True
+
+        try:
+            while time() - starttime <= timeout:
+                poll_due_orders()
+                dispatch()
+
+                polling = [t.next_poll for t in tracks.values() if not t.complete]
+                if not polling and pool.pending == 0 and not any(t.backlog for t in tracks.values()):
+                    break
+                wake_time = min(polling) if polling else None
+
+                # yield finished downloads (refilling the workers) until the next order is due a poll
+                for (order_id, name), result in pool.iter_completed(
+                        timeout=None if wake_time is None else max(0, wake_time - time()), on_error=on_error):
+                    track = tracks[order_id]
+                    track.in_flight -= 1
+                    track.state.mark_done(name, result[0])
+                    dispatch()
+                    yield order_id, result
+                    if wake_time is not None and time() >= wake_time:
+                        break
+
+                if pool.pending == 0 and wake_time is not None:
+                    sleep(max(0, wake_time - time()))
+        finally:
+            for track in tracks.values():
+                track.state.save()
+            if pool is not downloader:
+                pool.close(cancel=True)
@@ -1,24 +1,144 @@
-import wget
+import requests
+import urllib3
 import tarfile
 import os
+import errno
+import shutil
 import gzip
 import zipfile
-from time import sleep
+from fnmatch import fnmatch
+from functools import partial
+from collections import namedtuple
+from time import sleep, time
 import threading
-from queue import Queue
+from queue import Queue, Empty
+from espa_api_client.conf import CHUNK_SIZE, DOWNLOAD_RETRIES, RETRY_BACKOFF, RETRY_BACKOFF_MAX, TIMEOUT
+from espa_api_client.Exceptions import DownloadError, IncompleteDownloadError
+from espa_api_client.Sessions import get_shared_session
 
+RETRY_STATUSES = (408, 429)     # client error statuses worth retrying, every other 4xx fails at once
+# local file errors, which retrying won't fix
+LOCAL_ERRNOS = {errno.ENOSPC, errno.EACCES, errno.EPERM, errno.EROFS, errno.EDQUOT, errno.EISDIR,
+                errno.ENOTDIR, errno.ENAMETOOLONG}
 
-def extract_archive(source_path, destination_path=None, delete_originals=False):
+
+def _is_permanent(error):
+    """
+    True for download errors retrying can't fix: http client errors (4xx other than
+    RETRY_STATUSES, from requests or aiohttp) and local file system errors.
+    """
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None) or getattr(error, "status", None)
+    if isinstance(status, int) and 400 <= status < 500 and status not in RETRY_STATUSES:
+        return True
+    return (isinstance(error, OSError) and not isinstance(error, requests.RequestException)
+            and error.errno in LOCAL_ERRNOS)
+
+
+class ExtractStats(namedtuple("ExtractStats", ["path", "nbytes", "seconds"])):
+    """ summary of one extraction, nbytes counts the bytes written out """
+
+    @property
+    def throughput(self):
+        """ bytes written per second """
+        return self.nbytes / self.seconds if self.seconds > 0 else float("inf")
+
+    def __str__(self):
+        return "{0:.1f} MB in {1:.1f}s ({2:.1f} MB/s)".format(
+            self.nbytes / 1e6, self.seconds, self.throughput / 1e6)
+
+
+def member_filter(include=None, exclude=None, predicate=None):
+    """
+    Builds a function of archive member name -> bool, which is True for members that should be
+    extracted. Glob patterns are matched against both the full member name and its basename,
+    so "*sr_ndvi*" and "*_cfmask.tif" select bands regardless of the folder they are in.
+    Returns None if no filtering was asked for.
+
+    :param include:     glob pattern or list of patterns, members must match at least one
+    :param exclude:     glob pattern or list of patterns, members must not match any
+    :param predicate:   function of member name -> bool, members must pass it
+    """
+    if include is None and exclude is None and predicate is None:
+        return None
+    if isinstance(include, str):
+        include = [include]
+    if isinstance(exclude, str):
+        exclude = [exclude]
+
+    def matches(name, patterns):
+        basename = os.path.basename(name.rstrip("/"))
+        return any(fnmatch(name, p) or fnmatch(basename, p) for p in patterns)
+
+    def keep(name):
+        if include is not None and not matches(name, include):
+            return False
+        if exclude is not None and matches(name, exclude):
+            return False
+        return predicate is None or predicate(name)
+
+    return keep
+
+
+def _extract_tar(tfile, destination_path, keep=None):
+    """
+    extracts members of an open tarfile one at a time, returns the number of bytes written.
+    with a keep function, only files it accepts are extracted (folders are created as needed).
+    """
+    os.makedirs(destination_path, exist_ok=True)
+    nbytes = 0
+    for member in tfile:
+        if keep is not None and (member.isdir() or not keep(member.name)):
+            continue
+        tfile.extract(member, destination_path)
+        if member.isfile():
+            nbytes += member.size
+    return nbytes
+
+
+def _extract_zip(zipf, destination_path, buffer_size, keep=None):
+    """ extracts members of an open zipfile in buffer_size chunks, returns the number of bytes written """
+    os.makedirs(destination_path, exist_ok=True)
+    root = os.path.realpath(destination_path)
+    nbytes = 0
+    for info in zipf.infolist():
+        if keep is not None and (info.is_dir() or not keep(info.filename)):
+            continue
+        target = os.path.realpath(os.path.join(root, info.filename))
+        if not target.startswith(root + os.sep):
+            raise Exception("zip member '{0}' would extract outside of {1}".format(info.filename, root))
+        if info.is_dir():
+            os.makedirs(target, exist_ok=True)
+            continue
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with zipf.open(info) as src, open(target, 'wb') as of:
+            shutil.copyfileobj(src, of, buffer_size)
+            nbytes += of.tell()
+    return nbytes
+
+
+def extract_archive(source_path, destination_path=None, delete_originals=False, buffer_size=CHUNK_SIZE,
+                    return_stats=False, include=None, exclude=None, predicate=None):
     """
     Attempts to decompress the following formats for input filepath
     Support formats include `.tar.gz`, `.tar`, `.gz`, `.zip`.
+    Every format is streamed through a buffer of at most buffer_size bytes, so memory
+    use does not grow with the size of the archive.
     :param source_path:         a file path to an archive
     :param destination_path:    path to unzip, will be same name with dropped extension if left None
     :param delete_originals:    Set to "True" if archives may be deleted after
                                 their contents is successful extracted.
+    :param buffer_size:         number of bytes read and written at a time
+    :param return_stats:        Set to "True" to return an ExtractStats tuple with the destination,
+                                the number of bytes extracted and the time it took.
+    :param include:             glob pattern(s) of member names to extract, see member_filter()
+    :param exclude:             glob pattern(s) of member names to skip
+    :param predicate:           function of member name -> bool, only passing members are extracted
     """
 
     head, tail = os.path.split(source_path)
+    starttime = time()
+    keep = member_filter(include, exclude, predicate)
 
     def set_destpath(destpath, file_ext):
         if destpath is not None:
@@ -27,62 +147,193 @@ def extract_archive(source_path, destination_path=None, delete_originals=False):
             return os.path.join(head, tail.replace(file_ext, ""))
 
     if source_path.endswith(".tar.gz"):
-        with tarfile.open(source_path, 'r:gz') as tfile:
-            tfile.extractall(set_destpath(destination_path, ".tar.gz"))
-            ret = destination_path
+        ret = set_destpath(destination_path, ".tar.gz")
+        with tarfile.open(source_path, 'r:gz', copybufsize=buffer_size) as tfile:
+            nbytes = _extract_tar(tfile, ret, keep)
 
     # gzip only compresses single files
     elif source_path.endswith(".gz"):
-        with gzip.open(source_path, 'rb') as gzfile:
-            content = gzfile.read()
-            with open(set_destpath(destination_path, ".gz"), 'wb') as of:
-                of.write(content)
-            ret = destination_path
+        ret = set_destpath(destination_path, ".gz")
+        nbytes = 0
+        if keep is None or keep(os.path.basename(ret)):
+            with gzip.open(source_path, 'rb') as gzfile:
+                with open(ret, 'wb') as of:
+                    shutil.copyfileobj(gzfile, of, buffer_size)
+                    nbytes = of.tell()
 
     elif source_path.endswith(".tar"):
-        with tarfile.open(source_path, 'r') as tfile:
-            tfile.extractall(set_destpath(destination_path, ".tar"))
-            ret = destination_path
+        ret = set_destpath(destination_path, ".tar")
+        with tarfile.open(source_path, 'r', copybufsize=buffer_size) as tfile:
+            nbytes = _extract_tar(tfile, ret, keep)
 
     elif source_path.endswith(".zip"):
+        ret = set_destpath(destination_path, ".zip")
         with zipfile.ZipFile(source_path, "r") as zipf:
-            zipf.extractall(set_destpath(destination_path, ".zip"))
-            ret = destination_path
+            nbytes = _extract_zip(zipf, ret, buffer_size, keep)
 
     else:
         raise Exception("supported types are tar.gz, gz, tar, zip")
 
-    print("Extracted {0}".format(source_path))
+    stats = ExtractStats(ret, nbytes, time() - starttime)
+    print("Extracted {0}, {1}".format(source_path, stats))
     if delete_originals:
         os.remove(source_path)
 
+    if return_stats:
+        return stats
     return ret
 
 
 class BaseDownloader(object):
-    """ basic downloader class with general/universal download utils """
+    """
+    basic downloader class with general/universal download utils.
+
+    Downloads are streamed in chunks to a '{destination}.part' file which is only
+    renamed to the destination once its size matches what the server reported.
+    After an interruption, the download resumes from the end of the '.part' file
+    with an http Range request, so a killed process can pick up where it left off.
+    """
 
-    def __init__(self, local_dir):
+    def __init__(self, local_dir, session=None, chunk_size=CHUNK_SIZE, retries=DOWNLOAD_RETRIES,
+                 timeout=TIMEOUT):
+        """
+        :param local_dir:   directory to download into, created if missing.
+        :param session:     optional requests.Session, defaults to the shared session
+        :param chunk_size:  number of bytes read and written at a time
+        :param retries:     number of retries after a failed attempt, waiting
+                            RETRY_BACKOFF * 2 ** attempt seconds (up to RETRY_BACKOFF_MAX)
+        :param timeout:     seconds to wait per request, or a (connect, read) tuple
+        """
         self.local_dir = local_dir
         self.queue = []
+        self.session = get_shared_session() if session is None else session
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.timeout = timeout
 
         if not os.path.exists(local_dir):
             os.mkdir(local_dir)
 
-    @staticmethod
-    def _download(source, dest, retries=2):
+    def _retry(self, attempt, source, dest, retries=None):
+        """ calls attempt(source, dest) until it succeeds, retrying with backoff on failures """
         trynum = 0
-        while trynum < retries:
+        while True:
             try:
-                wget.download(url=source, out=dest)
-                return dest
-            except:
-                sleep(1)
+                return attempt(source, dest)
+            except (requests.RequestException, urllib3.exceptions.HTTPError, IOError, EOFError,
+                    tarfile.TarError, IncompleteDownloadError) as e:
+                sleep(self._backoff(source, e, trynum, retries))
+                trynum += 1
+
+    def _backoff(self, source, error, trynum, retries=None):
+        """
+        seconds to wait before retrying after failed attempt number trynum (from 0), or
+        raises DownloadError once the retries are used up, or at once for errors retrying
+        can't fix (see _is_permanent). Shared with the async client.
+        """
+        if retries is None:
+            retries = self.retries
+        if _is_permanent(error):
+            raise DownloadError("Failed to download {0}: {1}".format(source, error))
+        if trynum >= retries:
+            raise DownloadError("Failed to download {0} after {1} attempts: {2}"
+                                .format(source, trynum + 1, error))
+        wait = min(RETRY_BACKOFF * 2 ** trynum, RETRY_BACKOFF_MAX)
+        print("Download of {0} failed ({1}), retrying in {2}s".format(source, error, wait))
+        return wait
+
+    def _download(self, source, dest, retries=None):
+        """ downloads source to dest, resuming and retrying with backoff on failures """
+        return self._retry(self._stream, source, dest, retries)
+
+    def _stream_extract(self, source, dest, retries=None, keep=None):
+        """
+        downloads a .tar.gz source and extracts it to dest without writing the archive to
+        disk. Streams can't be resumed, so a failed attempt starts over from the beginning.
+        """
+        return self._retry(partial(self._stream_tar, keep=keep), source, dest, retries)
+
+    def _stream_tar(self, source, dest, keep=None):
+        """
+        one attempt at piping the http response into tarfile, extracting members into
+        '{dest}.part' as they arrive. The directory is renamed to dest once complete.
+        """
+        part = dest + ".part"
+        if os.path.exists(part):
+            shutil.rmtree(part)
+
+        starttime = time()
+        with self.session.get(source, stream=True, timeout=self.timeout) as r:
+            r.raise_for_status()
+            with tarfile.open(fileobj=r.raw, mode='r|gz', bufsize=self.chunk_size,
+                              copybufsize=self.chunk_size) as tfile:
+                nbytes = _extract_tar(tfile, part, keep)
+
+        if os.path.exists(dest):
+            shutil.rmtree(dest)
+        os.replace(part, dest)
+        print("Extracted {0}, {1}".format(source, ExtractStats(dest, nbytes, time() - starttime)))
+        return dest
+
+    def _stream(self, source, dest):
+        """ one attempt at streaming source into '{dest}.part', renamed to dest once complete """
+        part, offset, headers = self._resume_point(dest)
+
+        with self.session.get(source, headers=headers, stream=True, timeout=self.timeout) as r:
+            if r.status_code == 416:
+                return self._finish_unsatisfiable(part, dest, offset, r.headers)
+            r.raise_for_status()
+
+            expected, write_mode = self._expected_size(r.status_code, r.headers)
+            with open(part, write_mode) as f:
+                for chunk in r.raw.stream(self.chunk_size, decode_content=False):
+                    f.write(chunk)
+
+        return self._finish_part(source, part, dest, expected)
+
+    # the steps of a resumable download around the http request itself, shared with the async client
+
+    @staticmethod
+    def _resume_point(dest):
+        """ returns the part file for dest, the number of bytes already in it, and the request headers to resume """
+        part = dest + ".part"
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        headers = {"Range": "bytes={0}-".format(offset)} if offset else {}
+        return part, offset, headers
+
+    @staticmethod
+    def _expected_size(status, headers):
+        """ returns the expected final size (str, may be empty) and the mode to open the part file with """
+        if status == 206:
+            return headers.get("Content-Range", "").rpartition("/")[2], 'ab'
+        return headers.get("Content-Length", ""), 'wb'    # server sent the whole file
+
+    @staticmethod
+    def _finish_unsatisfiable(part, dest, offset, headers):
+        """
+        handles a 416 response to a resume request: there is nothing left to fetch, so the
+        part file is complete if its size matches the remote size. Otherwise it is deleted.
+        """
+        expected = headers.get("Content-Range", "").rpartition("/")[2]
+        if expected.isdigit() and int(expected) == offset:
+            os.replace(part, dest)
+            return dest
+        os.remove(part)
+        raise IncompleteDownloadError("{0} does not match the remote file".format(part))
 
     @staticmethod
-    def _extract(source, dest):
+    def _finish_part(source, part, dest, expected):
+        """ checks the part file has the expected size and renames it to dest """
+        size = os.path.getsize(part)
+        if expected.isdigit() and size != int(expected):
+            raise IncompleteDownloadError("Received {0} of {1} bytes for {2}".format(size, expected, source))
+        os.replace(part, dest)
+        return dest
+
+    def _extract(self, source, dest, keep=None):
         """ extracts a file to destination"""
-        return extract_archive(source, dest, delete_originals=False)
+        return extract_archive(source, dest, delete_originals=False, buffer_size=self.chunk_size,
+                               predicate=keep)
 
     def _raw_destination_mapper(self, source):
         """ returns raw download destination from source url"""
@@ -95,26 +346,135 @@ class BaseDownloader(object):
         tilename = filename
         return os.path.join(self.local_dir, tilename)
 
-    def download(self, source, mode='w', cleanup=True):
+    def download(self, source, mode='w', cleanup=True, stream_extract=False, include=None, exclude=None,
+                 predicate=None):
         """
         Downloads the source url and extracts it to a folder. Returns
         a tuple with the extract destination, and a bool to indicate if it is a
         fresh download or if it was already found at that location.
 
-        :param source:  url from which to download data
-        :param mode:    either 'w' or 'w+' to write or overwrite
-        :param cleanup: use True to delete intermediate files (the tar.gz's)
+        :param source:          url from which to download data
+        :param mode:            either 'w' or 'w+' to write or overwrite
+        :param cleanup:         use True to delete intermediate files (the tar.gz's)
+        :param stream_extract:  use True to extract .tar.gz sources while they download,
+                                without ever writing the archive itself to disk.
+        :param include:         glob pattern(s) of archive members to extract, such as
+                                ["*sr_ndvi*", "*cfmask*"]. See Downloaders.member_filter()
+        :param exclude:         glob pattern(s) of archive members to skip
+        :param predicate:       function of member name -> bool, only passing members are extracted
         :return: tuple(destination path (str), new_download? (bool))
         """
         raw_dest = self._raw_destination_mapper(source)
         ext_dest = self._ext_destination_mapper(raw_dest)
-        if not os.path.exists(ext_dest) or mode == 'w+':
+        keep = member_filter(include, exclude, predicate)
+        if stream_extract and raw_dest.endswith(".tar.gz") and (not os.path.exists(ext_dest) or mode == 'w+'):
+            self._stream_extract(source, ext_dest, keep=keep)
+            fresh = True
+        elif not os.path.exists(ext_dest) or mode == 'w+':
+            if mode == 'w+' and os.path.exists(raw_dest + ".part"):
+                os.remove(raw_dest + ".part")
             self._download(source, raw_dest)
-            self._extract(raw_dest, ext_dest)
+            self._extract(raw_dest, ext_dest, keep)
             fresh = True
         else:
             print("Found: {0}, Use mode='w+' to force rewrite".format(ext_dest))
             fresh = False
         if cleanup and os.path.exists(raw_dest):
             os.remove(raw_dest)
-        return ext_dest, fresh
\ No newline at end of file
+        return ext_dest, fresh
+
+
+class ParallelDownloader(object):
+    """
+    Runs the download() method of another downloader on a pool of worker threads.
+    Sources are handed to the workers through a bounded queue, and results are
+    returned in the order the downloads finish, not the order they were submitted.
+    """
+
+    def __init__(self, downloader=None, workers=4, queue_size=None):
+        """
+        :param downloader:  the BaseDownloader (or child) instance which does the work
+        :param workers:     number of downloads to run at once
+        :param queue_size:  maximum number of submitted sources waiting for a free worker,
+                            submit() blocks while the queue is full. defaults to 2 * workers
+        """
+        if downloader is None:
+            downloader = BaseDownloader('espa_downloads')
+        if queue_size is None:
+            queue_size = 2 * workers
+
+        self.downloader = downloader
+        self.local_dir = downloader.local_dir
+        self.tasks = Queue(maxsize=queue_size)
+        self.results = Queue()
+        self.pending = 0
+        self.threads = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def _work(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                return
+            tag, source, dlkwargs = task
+            try:
+                self.results.put((tag, self.downloader.download(source, **dlkwargs), None))
+            except Exception as e:
+                self.results.put((tag, None, e))
+
+    def submit(self, source, tag=None, **dlkwargs):
+        """
+        queues the source url for download. The tag is returned alongside the result so
+        callers can tell which download finished.
+        """
+        self.pending += 1
+        self.tasks.put((tag, source, dlkwargs))
+
+    def download(self, source, **dlkwargs):
+        """ blocking download of a single source, same as the wrapped downloaders download() """
+        return self.downloader.download(source, **dlkwargs)
+
+    def iter_completed(self, timeout=None, on_error=None):
+        """
+        generator of (tag, download() result) tuples as downloads finish. Stops when
+        nothing is pending, or once timeout seconds have passed. Errors raised in a
+        worker are raised again here, unless an on_error(tag, error) function is given,
+        in which case failed downloads are passed to it instead and skipped.
+        """
+        deadline = None if timeout is None else time() + timeout
+        while self.pending > 0:
+            try:
+                if deadline is None:
+                    tag, result, error = self.results.get()
+                else:
+                    tag, result, error = self.results.get(timeout=max(0, deadline - time()))
+            except Empty:
+                return
+            self.pending -= 1
+            if error is None:
+                yield tag, result
+            elif on_error is None:
+                raise error
+            else:
+                on_error(tag, error)
+
+    def close(self, cancel=False):
+        """ stops the workers once queued downloads are done, or drops them if cancel is True """
+        if cancel:
+            try:
+                while True:
+                    self.tasks.get_nowait()
+                    self.pending -= 1
+            except Empty:
+                pass
+        for _ in self.threads:
+            self.tasks.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close(cancel=exc_type is not None)
@@ -3,7 +3,10 @@ class AuthError(Exception):
 
 
 class BadTileError(Exception):
-    pass
+    def __init__(self, message, invalid=()):
+        """ :param invalid: the tile ids which were found to be invalid """
+        super(BadTileError, self).__init__(message)
+        self.invalid = list(invalid)
 
 
 class EmptyOrderTemplate(Exception):
@@ -20,3 +23,15 @@ class InvalidClient(Exception):
 
 class DownloadURLError(Exception):
     pass
+
+
+class DownloadError(Exception):
+    pass
+
+
+class IncompleteDownloadError(DownloadError):
+    pass
+
+
+class SearchError(Exception):
+    pass
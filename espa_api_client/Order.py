@@ -1,12 +1,53 @@
 import json
+from collections import OrderedDict
+from collections.abc import MutableSet
+from concurrent.futures import ThreadPoolExecutor
+from copy import copy, deepcopy
 
 from espa_api_client.OrderTemplate import OrderTemplate
 from espa_api_client.Clients import Client
-from espa_api_client.parse import search_landsat_tiles, search_modis_tiles
-from espa_api_client.conf import LANDSAT_PRODUCTS, MODIS_PRODUCTS
+from espa_api_client.parse import invalid_tiles, index_rejected_tiles
 from espa_api_client.Exceptions import *
 
 
+class InputSet(MutableSet):
+    """
+    insertion ordered set of tile names, used for each products "inputs". Adding a tile
+    that is already present does nothing, and removing tiles costs O(1) per tile.
+    """
+
+    def __init__(self, tiles=()):
+        self._tiles = OrderedDict.fromkeys(tiles)
+
+    def __contains__(self, tile):
+        return tile in self._tiles
+
+    def __iter__(self):
+        return iter(self._tiles)
+
+    def __len__(self):
+        return len(self._tiles)
+
+    def __repr__(self):
+        return "InputSet({0})".format(list(self._tiles))
+
+    def add(self, tile):
+        self._tiles[tile] = None
+
+    def discard(self, tile):
+        self._tiles.pop(tile, None)
+
+    def update(self, tiles):
+        """ adds every tile in tiles """
+        for tile in tiles:
+            self._tiles[tile] = None
+
+    def difference_update(self, tiles):
+        """ removes every tile in tiles, ignoring those which are not present """
+        for tile in tiles:
+            self._tiles.pop(tile, None)
+
+
 class Order(object):
     def __init__(self, template, note, enforce_note=True):
         """
@@ -30,8 +71,12 @@ class Order(object):
             return not bool(s and s.strip())
 
         self.template = self._set_template(template)
-        self.order_content = template.template_content
+        self.order_content = deepcopy(self.template.template_content)
+        for value in self.order_content.values():
+            if isinstance(value, dict) and 'inputs' in value:
+                value['inputs'] = InputSet(value['inputs'])
         self.set_order_note(note)
+        self.rejected_tiles = OrderedDict()     # tile -> reason, for tiles dropped by submit()
 
         if enforce_note:
             if is_empty(self.order_content['note']):
@@ -57,25 +102,80 @@ class Order(object):
             raise EmptyOrderTemplate(
                 "Could not interpret template input of type '{0}'".format(type(template)))
 
+    @property
+    def content(self):
+        """ copy of order_content with each products "inputs" as a plain list """
+        content = {}
+        for key, value in self.order_content.items():
+            if isinstance(value, dict) and 'inputs' in value:
+                value = dict(value, inputs=list(value['inputs']))
+            content[key] = value
+        return content
+
     @property
     def json(self, **kwargs):
         """ json serialized order_content """
-        return json.dumps(self.order_content, **kwargs)
+        return json.dumps(self.content, **kwargs)
 
     def set_order_note(self, note):
         """ sets 'note' property of the order """
         self.order_content['note'] = note
 
+    @property
+    def n_inputs(self):
+        """ total number of input tiles across all products """
+        return sum(len(value['inputs']) for value in self.order_content.values()
+                   if isinstance(value, dict) and 'inputs' in value)
+
+    def _with_inputs(self, note, inputs):
+        """ returns a copy of this order with a different note, and inputs from a {product: tiles} dict """
+        order = copy(self)
+        order.rejected_tiles = OrderedDict()
+        order.order_content = {}
+        for key, value in self.order_content.items():
+            if isinstance(value, dict) and 'inputs' in value:
+                value = dict(deepcopy({k: v for k, v in value.items() if k != 'inputs'}),
+                             inputs=InputSet(inputs.get(key, ())))
+            else:
+                value = deepcopy(value)
+            order.order_content[key] = value
+        order.set_order_note(note)
+        return order
+
+    def shard(self, max_inputs):
+        """
+        splits this order into sub-orders of at most max_inputs tiles each, keeping tiles in order.
+        Sub-orders get notes '{note}-part-001', '{note}-part-002', and so on, so resubmitting
+        the same order finds the existing sub-orders through safe_post_order().
+        :return: list of Order instances
+        """
+        tiles = [(product, tile) for product, value in self.order_content.items()
+                 if isinstance(value, dict) and 'inputs' in value for tile in value['inputs']]
+
+        shards = []
+        for i, start in enumerate(range(0, len(tiles), max_inputs)):
+            inputs = {}
+            for product, tile in tiles[start:start + max_inputs]:
+                inputs.setdefault(product, []).append(tile)
+            note = "{0}-part-{1:03d}".format(self.order_content['note'], i + 1)
+            shards.append(self._with_inputs(note, inputs))
+        return shards
+
     def add_tiles(self, product, tiles):
-        """ adds tiles to a products "inputs" values """
+        """
+        adds tiles to a products "inputs" values. Every tile is validated against the
+        tile id format of the products family (landsat or modis) first, and if any are
+        invalid a BadTileError listing all of them (in its .invalid attribute) is raised
+        without adding anything.
+        """
         product = product.lower()
-        for tile in tiles:
-            matches_landsat = search_landsat_tiles(tile)
-            matches_modis = search_modis_tiles(tile)
-            if not (matches_landsat or matches_modis):
-                raise BadTileError("Input tile '{}' appears to be invalid!".format(tile))
+        tiles = list(tiles)
+        invalid = invalid_tiles(tiles, product)
+        if invalid:
+            raise BadTileError("{0} input tile(s) appear to be invalid for '{1}': {2}"
+                               .format(len(invalid), product, invalid), invalid=invalid)
         if product in self.order_content.keys():
-            self.order_content[product]['inputs'] += tiles
+            self.order_content[product]['inputs'].update(tiles)
         else:
             raise Exception("product '{0}' is not in template!".format(product))
         return self
@@ -84,45 +184,33 @@ class Order(object):
         """ removes tiles from products "inputs" values """
         product = product.lower()
         if product in self.order_content.keys():
-            for tile in tiles:
-                if tile in self.order_content[product]['inputs']:
-                    self.order_content[product]['inputs'].remove(tile)
+            self.order_content[product]['inputs'].difference_update(tiles)
 
     def content_purifier(self, response):
         """
         Parses request error messages to remove tiles which are mentioned in
         the error description. Used to remove problem tiles from the order and
-        subsequent resubmission.
+        subsequent resubmission. The response is indexed once, and every
+        mentioned tile is removed from every product in a single pass. Tiles
+        are matched regardless of case.
+        :return: OrderedDict of removed tile -> reason given in the response
         """
-        check_landsat = any([prod in self.order_content.keys() for prod in LANDSAT_PRODUCTS])
-        check_modis = any([prod in self.order_content.keys() for prod in MODIS_PRODUCTS])
-
-        if 'status' in response.keys():
-            if response['status'] == 400:
+        removed = OrderedDict()
+        if response.get('status') != 400:
+            return removed
 
-                if check_landsat:
-                    bad_tiles = search_landsat_tiles(str(json.dumps(response)))
-                    print("Removing {} bad landsat tiles".format(len(bad_tiles)))
-                    for product in LANDSAT_PRODUCTS:
-                        self.remove_tiles(product, bad_tiles)
+        rejected = index_rejected_tiles(response)
+        for product, value in self.order_content.items():
+            if isinstance(value, dict) and 'inputs' in value:
+                present = [tile for tile in value['inputs'] if tile.upper() in rejected]
+                value['inputs'].difference_update(present)
+                for tile in present:
+                    removed[tile] = rejected[tile.upper()]
+        print("Removing {} rejected tiles".format(len(removed)))
+        return removed
 
-                if check_modis:
-                    bad_tiles = search_modis_tiles(str(json.dumps(response)))
-                    print("Removing {} bad modis tiles".format(len(bad_tiles)))
-                    for product in MODIS_PRODUCTS:
-                        self.remove_tiles(product, bad_tiles)
-
-    def submit(self, client=None, ignore_bad_requests=True):
-        """
-        submit the content of an order to an input Client instance.
-        :param client: optional, An authenticated espa_api_client.Client() instance.
-        :param ignore_bad_requests: set True to automatically retry orders with
-                                    errors in them by dumping all tiles mentioned in
-                                    the error message.
-        :return: server response
-        """
-
-        # the api rejects product specs with no inputs listed, so remove them before submitting.
+    def _drop_empty_products(self):
+        """ the api rejects product specs with no inputs listed, so remove them before submitting. """
         remove_list = []
         for top_level in self.order_content.keys():
             if isinstance(self.order_content[top_level], dict):
@@ -132,18 +220,78 @@ class Order(object):
         for rem in remove_list:
             del self.order_content[rem]
 
+    def submit(self, client=None, ignore_bad_requests=True, max_inputs=None, max_workers=None, max_rounds=3):
+        """
+        submit the content of an order to an input Client instance.
+        :param client: optional, An authenticated espa_api_client.Client() instance.
+        :param ignore_bad_requests: set True to automatically retry orders with
+                                    errors in them by dumping all tiles mentioned in
+                                    the error message. Tiles dropped this way are
+                                    recorded in self.rejected_tiles with their reasons.
+        :param max_inputs: optional maximum number of tiles per order. Larger orders are
+                           split with shard() and the sub-orders submitted concurrently.
+        :param max_workers: number of sub-orders to submit at once, defaults to client.max_workers
+        :param max_rounds: maximum number of resubmissions after rejected requests
+        :return: server response. For a split order, a dict with "shards", the response
+                 for each sub-order note, "orderids", the list of their order ids, and
+                 "rejected_tiles", the tiles dropped from all sub-orders.
+        """
         if client is None:
             client = Client()
-
-        if isinstance(client, Client):
-            response = client.safe_post_order(self.order_content)
-            if ignore_bad_requests and 'status' in response.keys():
-                if response['status'] == 400:
-                    print("dumping rejected tiles")
-                    self.content_purifier(response)
-                    response = client.safe_post_order(self.order_content)
-            return response
-        else:
+        if not isinstance(client, Client):
             raise InvalidClient("input 'client' must be an espa_api_client.Client instance")
 
+        if max_inputs is not None and self.n_inputs > max_inputs:
+            return self._submit_shards(client, ignore_bad_requests, max_inputs, max_workers, max_rounds)
+
+        return self._post(client.safe_post_order, ignore_bad_requests, max_rounds)
+
+    def _post(self, post, ignore_bad_requests=True, max_rounds=3):
+        """
+        posts the order content with post(content), then while the server rejects it, drops
+        the rejected tiles and posts again, for at most max_rounds resubmissions.
+        """
+        self._drop_empty_products()
+        response = post(self.content)
+        rounds = 0
+        while ignore_bad_requests and response.get('status') == 400 and rounds < max_rounds:
+            print("dumping rejected tiles")
+            removed = self.content_purifier(response)
+            if not removed:     # nothing left that the server complained about
+                break
+            self.rejected_tiles.update(removed)
+            self._drop_empty_products()
+            rounds += 1
+            response = post(self.content)
+        return response
+
+    def _submit_shards(self, client, ignore_bad_requests, max_inputs, max_workers, max_rounds):
+        """
+        the split order branch of submit(). Existing orders for every sub-order note are
+        looked up once, then only the sub-orders which don't exist yet are posted concurrently.
+        """
+        shards = self.shard(max_inputs)
+        print("Submitting {0} tiles as {1} orders".format(self.n_inputs, len(shards)))
+        notes = [order.order_content['note'] for order in shards]
+        existing = client.find_orders_with_notes(notes)
+
+        responses = {}
+        new_shards = []
+        for order in shards:
+            order_ids = existing[order.order_content['note']]
+            if order_ids:
+                responses[order.order_content['note']] = client._existing_order_response(order_ids)
+            else:
+                new_shards.append(order)
+
+        with ThreadPoolExecutor(max_workers=max_workers or client.max_workers) as executor:
+            posted = executor.map(lambda order: order._post(client.post_new_order, ignore_bad_requests, max_rounds),
+                                  new_shards)
+            responses.update(zip([order.order_content['note'] for order in new_shards], posted))
 
+        for order in shards:
+            self.rejected_tiles.update(order.rejected_tiles)
+        responses = OrderedDict((note, responses[note]) for note in notes)
+        return {"shards": responses,
+                "orderids": [response['orderid'] for response in responses.values() if 'orderid' in response],
+                "rejected_tiles": self.rejected_tiles}
@@ -0,0 +1,144 @@
+import os
+import sqlite3
+import threading
+from collections import namedtuple
+from time import time
+from espa_api_client.conf import ORDER_CACHE_PATH, ORDER_CACHE_TTL
+
+OrderRecord = namedtuple("OrderRecord", ["order_id", "note", "status", "last_seen"])
+
+
+class NoteIndex(object):
+    """
+    in memory index of order notes. Exact lookups are a dict lookup, and substring
+    lookups only check the notes which share every trigram with the search string.
+    Not thread safe on its own, OrderCache serializes access to it.
+    """
+
+    def __init__(self):
+        self.orders_by_note = {}
+        self.notes_by_trigram = {}
+
+    @staticmethod
+    def _trigrams(string):
+        return {string[i:i + 3] for i in range(len(string) - 2)}
+
+    def add(self, note, order_id):
+        if not note:
+            return
+        if note not in self.orders_by_note:
+            self.orders_by_note[note] = set()
+            for trigram in self._trigrams(note):
+                self.notes_by_trigram.setdefault(trigram, set()).add(note)
+        self.orders_by_note[note].add(order_id)
+
+    def remove(self, note, order_id):
+        order_ids = self.orders_by_note.get(note)
+        if order_ids is None:
+            return
+        order_ids.discard(order_id)
+        if not order_ids:
+            del self.orders_by_note[note]
+            for trigram in self._trigrams(note):
+                self.notes_by_trigram[trigram].discard(note)
+
+    def find(self, search_note, exact=False):
+        """ returns the set of order ids whose note equals (or contains) search_note """
+        if exact:
+            return set(self.orders_by_note.get(search_note, ()))
+
+        trigrams = self._trigrams(search_note)
+        if trigrams:
+            candidates = set.intersection(*[self.notes_by_trigram.get(t, set()) for t in trigrams])
+        else:
+            candidates = list(self.orders_by_note)   # too short to index
+
+        order_ids = set()
+        for note in candidates:
+            if search_note in note:
+                order_ids.update(self.orders_by_note.get(note, ()))
+        return order_ids
+
+
+class OrderCache(object):
+    """
+    Persistent local record of order id -> (note, status, last_seen), stored in sqlite.
+    Purged orders never change again so they are kept forever, every other order is
+    considered stale once it has not been seen for `ttl` seconds. All records are held
+    in memory for lookups, the database is only written to.
+    """
+
+    def __init__(self, path=ORDER_CACHE_PATH, ttl=ORDER_CACHE_TTL):
+        """
+        :param path:    path to the sqlite database file, created if missing.
+        :param ttl:     seconds after which a non purged order should be fetched again.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.records = {}
+        self.index = NoteIndex()
+        self._lock = threading.Lock()
+
+        head = os.path.dirname(path)
+        if head and not os.path.exists(head):
+            os.makedirs(head)
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS orders "
+                         "(order_id TEXT PRIMARY KEY, note TEXT, status TEXT, last_seen REAL)")
+        for row in self._db.execute("SELECT order_id, note, status, last_seen FROM orders"):
+            self._remember(OrderRecord(*row))
+
+    def _remember(self, record):
+        old = self.records.get(record.order_id)
+        if old is not None:
+            self.index.remove(old.note, old.order_id)
+        self.records[record.order_id] = record
+        self.index.add(record.note, record.order_id)
+
+    def get(self, order_id):
+        """ returns the OrderRecord for order_id, or None if it isn't cached """
+        return self.records.get(order_id)
+
+    def is_fresh(self, order_id):
+        """ True if order_id is cached and either purged or seen within the ttl """
+        record = self.records.get(order_id)
+        if record is None:
+            return False
+        return record.status == "purged" or time() - record.last_seen < self.ttl
+
+    def put(self, order_id, note, status, last_seen=None):
+        """ stores (or updates) one order """
+        record = OrderRecord(order_id, note, status, time() if last_seen is None else last_seen)
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO orders VALUES (?, ?, ?, ?)", record)
+            self._db.commit()
+            self._remember(record)
+        return record
+
+    def invalidate(self, order_id=None):
+        """ forgets one order, or every non purged order if order_id is None """
+        with self._lock:
+            if order_id is None:
+                order_ids = [o for o, r in self.records.items() if r.status != "purged"]
+            else:
+                order_ids = [order_id] if order_id in self.records else []
+            self._db.executemany("DELETE FROM orders WHERE order_id = ?", [(o,) for o in order_ids])
+            self._db.commit()
+            for o in order_ids:
+                record = self.records.pop(o)
+                self.index.remove(record.note, o)
+
+    def find(self, search_note, exact=False, active_only=True):
+        """
+        returns the set of cached order ids with a note which CONTAINS search_note,
+        or which exactly matches it if exact is True.
+        """
+        with self._lock:
+            order_ids = self.index.find(search_note, exact)
+            if active_only:
+                order_ids = {o for o in order_ids if self.records[o].status != "purged"}
+        return order_ids
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,84 @@
+import json
+import os
+
+
+class ItemStateTable(object):
+    """
+    Keeps track of the items in one order: the last known status of every item, and
+    which completed items have already been handed to a downloader. Each status check
+    then only needs to act on items which completed since the previous one.
+
+    The table can be saved to and loaded from a json file, so a restarted process
+    resumes with what it already knows instead of revisiting every completed item.
+    """
+
+    def __init__(self, order_id, path=None):
+        """
+        :param order_id:    order name
+        :param path:        optional json file to persist the table to. It is loaded
+                            if it exists.
+        """
+        self.order_id = order_id
+        self.path = path
+        self.statuses = {}      # item name -> last seen status
+        self.done = {}          # item name -> download result path
+        self.pending = set()    # item names handed to a downloader but not finished yet
+        self.failed = {}        # item name -> error message of its last failed download
+
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    def update(self, items):
+        """
+        records the statuses of the input items, and returns the list of complete items
+        which are neither downloaded nor pending yet.
+        """
+        new_items = []
+        for item in items:
+            name = item["name"]
+            self.statuses[name] = item["status"]
+            if item["status"] == "complete" and name not in self.done and name not in self.pending:
+                new_items.append(item)
+        return new_items
+
+    def mark_pending(self, name):
+        """ records that an item was handed to a downloader """
+        self.pending.add(name)
+
+    def mark_done(self, name, path=None):
+        """ records that an item finished downloading to path """
+        self.pending.discard(name)
+        self.failed.pop(name, None)
+        self.done[name] = path
+
+    def mark_failed(self, name, error):
+        """
+        records that an items download failed. It is no longer pending, so the next
+        update() returns it again to be retried.
+        """
+        self.pending.discard(name)
+        self.failed[name] = str(error)
+
+    def load(self, path=None):
+        """ loads the table from json. uses self.path if no path is supplied """
+        if path is None:
+            path = self.path
+        with open(path, 'r') as f:
+            content = json.loads(f.read())
+        self.statuses = content["statuses"]
+        self.done = content["done"]
+        self.failed = content.get("failed", {})
+        return self
+
+    def save(self, path=None):
+        """ saves the table to json. uses self.path if no path is supplied, does nothing without either """
+        if path is None:
+            path = self.path
+        if path is None:
+            return self
+
+        content = {"order_id": self.order_id, "statuses": self.statuses, "done": self.done, "failed": self.failed}
+        with open(path + ".tmp", 'w+') as f:
+            f.write(json.dumps(content, indent=2))
+        os.replace(path + ".tmp", path)
+        return self
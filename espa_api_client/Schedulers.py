@@ -0,0 +1,73 @@
+from collections import Counter
+from time import time
+
+FINISHED_STATUSES = ('complete', 'error', 'unavailable')
+
+
+def count_statuses(items):
+    """ returns a Counter of item status -> number of items """
+    return Counter(item['status'] for item in items)
+
+
+class AdaptiveScheduler(object):
+    """
+    Decides how long to wait between order status checks. Polls quickly while
+    items are changing status, backs off exponentially while nothing changes,
+    and never waits much longer than the observed time it takes an item to finish.
+    """
+
+    def __init__(self, min_interval=30, max_interval=300, backoff=2.0):
+        """
+        :param min_interval:    seconds to wait after a check where item statuses changed
+        :param max_interval:    longest wait between two checks
+        :param backoff:         factor the wait grows by after each check without changes
+        """
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.interval = min_interval
+        self.last_counts = None
+        self.first_seen = None      # (time, number of finished items) of the first check
+        self.last_seen = None       # (time, number of finished items) of the latest check
+
+    def update(self, counts, now=None):
+        """
+        records the item status counts from the latest check, and returns the number
+        of seconds to wait before the next one.
+
+        :param counts:  dict of item status -> number of items, see count_statuses()
+        """
+        now = time() if now is None else now
+        finished = sum(counts.get(status, 0) for status in FINISHED_STATUSES)
+        if self.first_seen is None:
+            self.first_seen = (now, finished)
+        self.last_seen = (now, finished)
+
+        if counts != self.last_counts:
+            self.interval = self.min_interval
+        else:
+            # back off from at least 1 second, so a min_interval of 0 still grows
+            self.interval = min(max(self.interval, 1) * self.backoff, self.max_interval)
+        self.last_counts = dict(counts)
+
+        rate = self.rate()
+        if rate:
+            return max(self.min_interval, min(self.interval, 1.0 / rate))
+        return self.interval
+
+    def rate(self):
+        """ observed number of items finished per second, None until an item has finished """
+        if self.first_seen is None:
+            return None
+        seconds = self.last_seen[0] - self.first_seen[0]
+        finished = self.last_seen[1] - self.first_seen[1]
+        if seconds <= 0 or finished <= 0:
+            return None
+        return finished / seconds
+
+    def estimate_remaining(self, n_active):
+        """ estimated seconds until n_active more items finish, None if there is no rate yet """
+        rate = self.rate()
+        if rate is None:
+            return None
+        return n_active / rate
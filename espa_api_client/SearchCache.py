@@ -0,0 +1,108 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+from datetime import date, timedelta
+from time import time
+from espa_api_client.conf import SEARCH_CACHE_PATH, SEARCH_CACHE_TTL, SEARCH_CACHE_SETTLED_DAYS, \
+    SEARCH_CACHE_MAX_ENTRIES
+
+_PATH_ROW_TERM = re.compile(r"\(path:\d+\+AND\+row:\d+\)")
+_DATE_RANGE = re.compile(r"acquisitionDate:\[([\d-]+)\+TO\+([\d-]+)\]")
+
+
+class SearchCache(object):
+    """
+    Persistent cache of scene search responses, stored in sqlite and keyed on the
+    normalized query string, limit and skip. Scenes are not added to date ranges which
+    ended more than `settled_days` ago, so those responses are kept forever, every other
+    response is sent again once it is older than `ttl` seconds. Only the `max_entries`
+    most recently used responses are kept.
+    """
+
+    def __init__(self, path=SEARCH_CACHE_PATH, ttl=SEARCH_CACHE_TTL, settled_days=SEARCH_CACHE_SETTLED_DAYS,
+                 max_entries=SEARCH_CACHE_MAX_ENTRIES):
+        """
+        :param path:            path to the sqlite database file, created if missing.
+        :param ttl:             seconds after which a response for recent dates is stale.
+        :param settled_days:    days after which no new scenes are expected for a date.
+        :param max_entries:     maximum number of responses to keep.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.settled_days = settled_days
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+        head = os.path.dirname(path)
+        if head and not os.path.exists(head):
+            os.makedirs(head)
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS searches "
+                         "(key TEXT PRIMARY KEY, response TEXT, stored REAL, last_used REAL, permanent INTEGER)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS searches_last_used ON searches (last_used)")
+
+    @staticmethod
+    def key(search_string, limit, skip=0):
+        """
+        cache key of a query. Path/row terms are sorted and deduplicated, so the same
+        path/rows listed in a different order share an entry.
+        """
+        terms = sorted(set(_PATH_ROW_TERM.findall(search_string)))
+        rest = _PATH_ROW_TERM.sub("", search_string)
+        return "{0}|{1}|limit={2}|skip={3}".format(rest, "+OR+".join(terms), limit, skip)
+
+    def is_historical(self, search_string):
+        """ True if the query has a date range which ended more than settled_days ago """
+        match = _DATE_RANGE.search(search_string)
+        if match is None:
+            return False
+        settled = (date.today() - timedelta(days=self.settled_days)).isoformat()
+        return match.group(2) < settled
+
+    def get(self, search_string, limit, skip=0):
+        """ returns the cached response for a query, or None if it is missing or stale """
+        key = self.key(search_string, limit, skip)
+        now = time()
+        with self._lock:
+            row = self._db.execute("SELECT response, stored, permanent FROM searches WHERE key = ?",
+                                   (key,)).fetchone()
+            if row is None:
+                return None
+            response, stored, permanent = row
+            if not permanent and now - stored >= self.ttl:
+                return None
+            self._db.execute("UPDATE searches SET last_used = ? WHERE key = ?", (now, key))
+            self._db.commit()
+        return json.loads(response)
+
+    def put(self, search_string, limit, response, skip=0):
+        """ stores the response for a query, dropping the least recently used beyond max_entries """
+        key = self.key(search_string, limit, skip)
+        now = time()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO searches VALUES (?, ?, ?, ?, ?)",
+                             (key, json.dumps(response), now, now, int(self.is_historical(search_string))))
+            self._db.execute("DELETE FROM searches WHERE key IN (SELECT key FROM searches "
+                             "ORDER BY last_used DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+            self._db.commit()
+        return response
+
+    def invalidate(self, search_string=None):
+        """ forgets every cached page of one query, or every non historical response if search_string is None """
+        with self._lock:
+            if search_string is None:
+                self._db.execute("DELETE FROM searches WHERE permanent = 0")
+            else:
+                prefix = self.key(search_string, 0).rsplit("|limit=", 1)[0] + "|limit="
+                self._db.execute("DELETE FROM searches WHERE substr(key, 1, ?) = ?", (len(prefix), prefix))
+            self._db.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM searches").fetchone()[0]
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,85 @@
+import threading
+from collections import deque
+from itertools import islice
+import requests
+from requests.adapters import HTTPAdapter
+from espa_api_client.conf import POOL_CONNECTIONS, POOL_MAXSIZE, POOL_BLOCK, MAX_RETRIES, KEEP_ALIVE
+
+_shared_sessions = {}
+_shared_lock = threading.Lock()
+
+
+def build_session(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, pool_block=POOL_BLOCK,
+                  max_retries=MAX_RETRIES, keep_alive=KEEP_ALIVE):
+    """
+    Builds a new requests.Session with a pooled adapter mounted for http and https.
+    Connections are kept alive between calls, so repeated calls to the same host
+    skip the TCP and TLS handshakes.
+
+    :param pool_connections:    number of distinct hosts to keep connection pools for
+    :param pool_maxsize:        maximum number of connections kept open per host
+    :param pool_block:          set True to block when a hosts pool is exhausted instead
+                                of opening throwaway connections beyond pool_maxsize
+    :param max_retries:         retries for failed connections (not for failed requests)
+    :param keep_alive:          set False to close the connection after each request
+    :return: requests.Session
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_connections,
+                          pool_maxsize=pool_maxsize,
+                          pool_block=pool_block,
+                          max_retries=max_retries)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    if not keep_alive:
+        session.headers["Connection"] = "close"
+    return session
+
+
+def get_shared_session(**kwargs):
+    """
+    Returns the process wide session for the given build_session() keyword arguments,
+    building it on first use. Every client built with the same pool settings reuses
+    the same connection pool.
+    """
+    key = tuple(sorted(kwargs.items()))
+    with _shared_lock:
+        if key not in _shared_sessions:
+            _shared_sessions[key] = build_session(**kwargs)
+        return _shared_sessions[key]
+
+
+def close_shared_sessions():
+    """ closes every shared session and drops its pooled connections """
+    with _shared_lock:
+        for session in _shared_sessions.values():
+            session.close()
+        _shared_sessions.clear()
+
+
+def iter_window(items, submit, size):
+    """
+    Submits work for each item with at most size submitted ahead of the consumer, the
+    concurrency pattern shared by the order and search generators. Yields (item, handle)
+    tuples in input order, where handle is submit(item), such as a concurrent.futures
+    Future or an asyncio Task. Taking one pair submits the next item, so the window stays
+    full, and handles still in the window are cancelled when the generator is closed.
+    Close it (e.g. with contextlib.closing) before shutting down the executor it submits to.
+
+    :param items:       iterable of inputs, consumed lazily
+    :param submit:      function of item -> handle with a cancel() method
+    :param size:        maximum number of handles submitted but not yet yielded
+    """
+    items = iter(items)
+    in_flight = deque()
+    try:
+        for item in islice(items, size):
+            in_flight.append((item, submit(item)))
+        while in_flight:
+            item, handle = in_flight.popleft()
+            for next_item in islice(items, 1):  # keep the window full
+                in_flight.append((next_item, submit(next_item)))
+            yield item, handle
+    finally:
+        for _, handle in in_flight:
+            handle.cancel()
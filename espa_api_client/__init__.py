@@ -1,8 +1,69 @@
-from espa_api_client.Clients import *
-from espa_api_client.Downloaders import *
-from espa_api_client.Exceptions import *
-from espa_api_client.Order import *
-from espa_api_client.OrderTemplate import *
-from espa_api_client.parse import *
+"""
+Public names are loaded lazily: importing the package is cheap, and a submodule (and
+its dependencies, such as requests or aiohttp) is only imported the first time one of
+its names is used. `from espa_api_client import OrderTemplate` then never imports the
+http clients at all.
+"""
+import sys
+from importlib import import_module
+from types import ModuleType
 
+# submodule -> public names it provides to the package
+_EXPORTS = {
+    'AsyncClients': ('AsyncResponse', 'AsyncBaseClient', 'AsyncClient'),
+    'Clients': ('BaseClient', 'Client', 'ServiceOfflineError'),
+    'conf': ('TEMPLATE_DIR', 'API_HOST_URL', 'API_VERSION', 'HEADERS', 'POOL_CONNECTIONS', 'POOL_MAXSIZE',
+             'POOL_BLOCK', 'MAX_RETRIES', 'KEEP_ALIVE', 'TIMEOUT', 'MAX_WORKERS', 'ORDER_CACHE_PATH',
+             'ORDER_CACHE_TTL', 'SEARCH_CACHE_PATH', 'SEARCH_CACHE_TTL', 'SEARCH_CACHE_SETTLED_DAYS',
+             'SEARCH_CACHE_MAX_ENTRIES', 'GEOCODE_CACHE_PATH', 'CHUNK_SIZE', 'DOWNLOAD_RETRIES',
+             'RETRY_BACKOFF', 'RETRY_BACKOFF_MAX', 'LANDSAT_TILE_REGEX', 'LANDSAT_SHORT_REGEX',
+             'MODIS_TILE_REGEX', 'LANDSAT_PRODUCTS', 'MODIS_PRODUCTS'),
+    'Downloaders': ('ExtractStats', 'member_filter', 'extract_archive', 'BaseDownloader', 'ParallelDownloader'),
+    'Exceptions': ('AuthError', 'BadTileError', 'EmptyOrderTemplate', 'InvalidOrderNote', 'InvalidClient',
+                   'DownloadURLError', 'DownloadError', 'IncompleteDownloadError', 'SearchError'),
+    'Order': ('InputSet', 'Order'),
+    'OrderCache': ('OrderRecord', 'NoteIndex', 'OrderCache'),
+    'OrderState': ('ItemStateTable',),
+    'OrderTemplate': ('OrderTemplate',),
+    'parse': ('LANDSAT_TILE_PATTERN', 'LANDSAT_SHORT_PATTERN', 'MODIS_TILE_PATTERN', 'EXPORT_TILE_COLUMNS',
+              'EXPORT_ENCODING', 'ExportFilter', 'iter_order_inputs_from_earth_explorer_export',
+              'get_order_inputs_from_earth_explorer_export', 'invalid_tiles', 'search_landsat_tiles',
+              'search_modis_tiles', 'LandsatTile', 'ModisTile', 'parse_tile', 'parse_tiles', 'tile_sort_key',
+              'index_rejected_tiles'),
+    'Schedulers': ('FINISHED_STATUSES', 'count_statuses', 'AdaptiveScheduler'),
+    'SearchCache': ('SearchCache',),
+    'Sessions': ('build_session', 'get_shared_session', 'close_shared_sessions', 'iter_window'),
+}
 
+_NAME_TO_MODULE = {name: module for module, names in _EXPORTS.items() for name in names}
+
+__all__ = sorted(_NAME_TO_MODULE)
+
+
+class _LazyModule(ModuleType):
+    """
+    The package module. Resolves public names and submodules on first access, and keeps
+    names from being replaced by the submodules of the same name ('Order', 'OrderTemplate'),
+    which the import system binds onto the package whenever they are imported.
+    """
+
+    def __getattr__(self, name):
+        if name in _NAME_TO_MODULE:
+            value = getattr(import_module("{0}.{1}".format(self.__name__, _NAME_TO_MODULE[name])), name)
+        elif name in _EXPORTS:      # submodules, as the eager star imports used to load them all
+            value = import_module("{0}.{1}".format(self.__name__, name))
+        else:
+            raise AttributeError("module '{0}' has no attribute '{1}'".format(self.__name__, name))
+        ModuleType.__setattr__(self, name, value)
+        return value
+
+    def __setattr__(self, name, value):
+        if name in _NAME_TO_MODULE and isinstance(value, ModuleType):
+            return
+        ModuleType.__setattr__(self, name, value)
+
+    def __dir__(self):
+        return sorted(set(ModuleType.__dir__(self)) | set(__all__) | set(_EXPORTS))
+
+
+sys.modules[__name__].__class__ = _LazyModule
@@ -6,15 +6,41 @@ API_HOST_URL = 'https://espa.cr.usgs.gov'
 API_VERSION = 'v0'
 HEADERS = {'Content-Type': 'application/json'}
 
-LANDSAT_TILE_REGEX = "(L)(C|O|T|E)(7|8|5|4)(\d{3})(\d{3})(\d{7})(\w{3})(\d{2})"
-LANDSAT_SHORT_REGEX = "(L)(C|O|T|E)(7|8|5|4)(\d{3})(\d{3})(\d{7})"
+# http connection pooling, shared by every client in the process
+POOL_CONNECTIONS = 4            # number of hosts to keep pools for
+POOL_MAXSIZE = 16               # open connections kept per host
+POOL_BLOCK = False              # block when a hosts pool is exhausted
+MAX_RETRIES = 2                 # retries on failed connections
+KEEP_ALIVE = True
+TIMEOUT = (10, 120)             # (connect, read) seconds
+MAX_WORKERS = 8                 # concurrent api calls for bulk client methods
+
+# local cache of order notes and statuses
+ORDER_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.espa_api_client', 'orders.sqlite')
+ORDER_CACHE_TTL = 6 * 3600      # seconds before a non purged order is fetched again
+
+# local cache of scene search results
+SEARCH_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.espa_api_client', 'searches.sqlite')
+SEARCH_CACHE_TTL = 6 * 3600     # seconds before a search covering recent dates is sent again
+SEARCH_CACHE_SETTLED_DAYS = 30  # searches ending this many days ago are historical and kept forever
+SEARCH_CACHE_MAX_ENTRIES = 2000 # least recently used searches are dropped beyond this
+GEOCODE_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.espa_api_client', 'geocodes.json')
+
+# product downloads
+CHUNK_SIZE = 1024 * 1024        # bytes written per chunk while streaming downloads
+DOWNLOAD_RETRIES = 5            # retries after a failed or interrupted download
+RETRY_BACKOFF = 2               # seconds before the first retry, doubled on every retry
+RETRY_BACKOFF_MAX = 300         # longest wait between retries
+
+LANDSAT_TILE_REGEX = r"(L)(C|O|T|E)(7|8|5|4)(\d{3})(\d{3})(\d{7})(\w{3})(\d{2})"
+LANDSAT_SHORT_REGEX = r"(L)(C|O|T|E)(7|8|5|4)(\d{3})(\d{3})(\d{7})"
 LANDSAT_PRODUCTS = ["oli8",
                     "tm4",
                     "tm5",
                     "etm7",
                     "olitirs8"]
 
-MODIS_TILE_REGEX = "(M)(Y|O)(D)(\d{2})(G|Q|A)(\w{1}|\d{1}).(A\d{7}).(h\d{2}v\d{2}).(\d{3}).(\d{13})"
+MODIS_TILE_REGEX = r"(M)(Y|O)(D)(\d{2})(G|Q|A)(\w{1}|\d{1})\.(A\d{7})\.(h\d{2}v\d{2})\.(\d{3})\.(\d{13})"
 MODIS_PRODUCTS = ["myd09gq",
                   "myd09ga",
                   "myd13q1",
@@ -1,22 +1,272 @@
-import pandas as pd
+import csv
+import gzip
 import re
+import sys
 import json
-from espa_api_client.conf import LANDSAT_TILE_REGEX, LANDSAT_SHORT_REGEX, MODIS_TILE_REGEX
+from collections import OrderedDict, namedtuple
+from datetime import date, timedelta
+from functools import lru_cache
+from espa_api_client.Exceptions import BadTileError
+from espa_api_client.conf import LANDSAT_TILE_REGEX, LANDSAT_SHORT_REGEX, MODIS_TILE_REGEX, \
+    LANDSAT_PRODUCTS, MODIS_PRODUCTS
 
+LANDSAT_TILE_PATTERN = re.compile(LANDSAT_TILE_REGEX, re.IGNORECASE)
+LANDSAT_SHORT_PATTERN = re.compile(LANDSAT_SHORT_REGEX, re.IGNORECASE)
+MODIS_TILE_PATTERN = re.compile(MODIS_TILE_REGEX, re.IGNORECASE)
 
-def get_order_inputs_from_earth_explorer_export(csv_path):
+# whole-string validators for each product family, any of the alternatives is accepted
+_LANDSAT_VALIDATOR = re.compile("(?:{0})|(?:{1})".format(LANDSAT_TILE_REGEX, LANDSAT_SHORT_REGEX), re.IGNORECASE)
+_MODIS_VALIDATOR = re.compile(MODIS_TILE_REGEX, re.IGNORECASE)
+_ANY_VALIDATOR = re.compile("(?:{0})|(?:{1})".format(_LANDSAT_VALIDATOR.pattern, MODIS_TILE_REGEX), re.IGNORECASE)
+
+
+# tile id columns of earth explorer exports, and how to turn their values into tile ids
+EXPORT_TILE_COLUMNS = OrderedDict([
+    ('Landsat Scene Identifier', lambda value: value),
+    ('Local Granule ID', lambda value: value.replace(".hdf", "")),
+])
+EXPORT_ENCODING = "ISO-8859-1"
+
+
+def _open_export(csv_path):
+    """ opens a plain or gzipped (.gz) csv export for reading text """
+    if csv_path.endswith(".gz"):
+        return gzip.open(csv_path, 'rt', encoding=EXPORT_ENCODING, newline='')
+    return open(csv_path, 'r', encoding=EXPORT_ENCODING, newline='')
+
+
+class ExportFilter(object):
+    """
+    Filters earth explorer export rows on their scene metadata. Landsat and modis
+    exports name their columns differently, so each filter checks whichever of its
+    columns the export has. A filter is ignored for exports without any of its
+    columns (modis exports have no cloud cover or wrs path/row, for example).
+    """
+
+    CLOUD_COLUMNS = ('Scene Cloud Cover', 'Cloud Cover')
+    DATE_COLUMNS = ('Date Acquired', 'Acquisition Start Date')
+    PATH_ROW_COLUMNS = (('WRS Path', 'WRS Row'),)
+    CORNER_COLUMNS = (
+        (('NW Corner Lat dec', 'NW Corner Long dec'), ('NE Corner Lat dec', 'NE Corner Long dec'),
+         ('SE Corner Lat dec', 'SE Corner Long dec'), ('SW Corner Lat dec', 'SW Corner Long dec')),
+        (('Corner Upper Left Lat dec', 'Corner Upper Left Long dec'),
+         ('Corner Upper Right Lat dec', 'Corner Upper Right Long dec'),
+         ('Corner Lower Right Lat dec', 'Corner Lower Right Long dec'),
+         ('Corner Lower Left Lat dec', 'Corner Lower Left Long dec')),
+    )
+
+    def __init__(self, cloud_min=None, cloud_max=None, start_date=None, end_date=None, path_rows=None,
+                 bbox=None):
+        """
+        :param cloud_min:   minimum scene cloud cover percentage
+        :param cloud_max:   maximum scene cloud cover percentage
+        :param start_date:  earliest acquisition date, as 'YYYY-MM-DD' or a datetime.date
+        :param end_date:    latest acquisition date, as 'YYYY-MM-DD' or a datetime.date
+        :param path_rows:   wrs (path, row) pairs to keep, as a list of pairs or a
+                            "015,033,016,033" string
+        :param bbox:        (west, south, east, north) in decimal degrees, scenes whose
+                            corners' bounding box intersects it are kept.
+        """
+        self.cloud_min = cloud_min
+        self.cloud_max = cloud_max
+        self.start_date = self._iso_date(start_date)
+        self.end_date = self._iso_date(end_date)
+        self.bbox = bbox
+
+        if isinstance(path_rows, str):
+            numbers = [int(n) for n in re.split(r"\D+", path_rows.strip()) if n]
+            path_rows = zip(numbers[0::2], numbers[1::2])
+        self.path_rows = None if path_rows is None else {(int(p), int(r)) for p, r in path_rows}
+
+    @staticmethod
+    def _iso_date(date):
+        """ 'YYYY-MM-DD' string from dates, and from the 'YYYY/MM/DD' strings used in exports """
+        if date is None:
+            return None
+        if not isinstance(date, str):
+            date = date.isoformat()
+        return date[:10].replace("/", "-")
+
+    @property
+    def columns(self):
+        """ every export column any of the active filters may read """
+        columns = []
+        if self.cloud_min is not None or self.cloud_max is not None:
+            columns += self.CLOUD_COLUMNS
+        if self.start_date is not None or self.end_date is not None:
+            columns += self.DATE_COLUMNS
+        if self.path_rows is not None:
+            columns += [c for pair in self.PATH_ROW_COLUMNS for c in pair]
+        if self.bbox is not None:
+            columns += [c for corners in self.CORNER_COLUMNS for pair in corners for c in pair]
+        return columns
+
+    @staticmethod
+    def _first(row, columns):
+        """ the first of columns present in row (a dict, or a pandas DataFrame), or None """
+        for column in columns:
+            if column in row:
+                return column
+        return None
+
+    def _corners(self, row):
+        """ the (lat, lon) column pairs of the first corner set present in row """
+        for corners in self.CORNER_COLUMNS:
+            if all(lat in row and lon in row for lat, lon in corners):
+                return corners
+        return None
+
+    def matches(self, row):
+        """ True if a {column: value string} row passes every filter """
+        try:
+            column = self._first(row, self.CLOUD_COLUMNS)
+            if column is not None:
+                cloud = float(row[column])
+                if self.cloud_min is not None and cloud < self.cloud_min:
+                    return False
+                if self.cloud_max is not None and cloud > self.cloud_max:
+                    return False
+
+            column = self._first(row, self.DATE_COLUMNS)
+            if column is not None:
+                date = self._iso_date(row[column])
+                if self.start_date is not None and date < self.start_date:
+                    return False
+                if self.end_date is not None and date > self.end_date:
+                    return False
+
+            if self.path_rows is not None:
+                for path, row_ in self.PATH_ROW_COLUMNS:
+                    if path in row and row_ in row and (int(row[path]), int(row[row_])) not in self.path_rows:
+                        return False
+
+            corners = self._corners(row) if self.bbox is not None else None
+            if corners is not None:
+                lats = [float(row[lat]) for lat, _ in corners]
+                lons = [float(row[lon]) for _, lon in corners]
+                west, south, east, north = self.bbox
+                if max(lons) < west or min(lons) > east or max(lats) < south or min(lats) > north:
+                    return False
+        except ValueError:  # blank or malformed metadata, can't tell if the scene is wanted
+            return False
+        return True
+
+    def mask(self, df):
+        """ vectorized matches() for a pandas DataFrame chunk, returns a boolean Series """
+        pd = sys.modules['pandas']
+        keep = pd.Series(True, index=df.index)
+
+        column = self._first(df, self.CLOUD_COLUMNS)
+        if column is not None:
+            cloud = pd.to_numeric(df[column], errors='coerce')
+            keep &= cloud.notna()
+            if self.cloud_min is not None:
+                keep &= cloud >= self.cloud_min
+            if self.cloud_max is not None:
+                keep &= cloud <= self.cloud_max
+
+        column = self._first(df, self.DATE_COLUMNS)
+        if column is not None:
+            date = df[column].str.slice(0, 10).str.replace("/", "-", regex=False)
+            if self.start_date is not None:
+                keep &= date >= self.start_date
+            if self.end_date is not None:
+                keep &= date <= self.end_date
+
+        if self.path_rows is not None:
+            for path, row in self.PATH_ROW_COLUMNS:
+                if path in df and row in df:
+                    pairs = zip(pd.to_numeric(df[path], errors='coerce'), pd.to_numeric(df[row], errors='coerce'))
+                    keep &= pd.Series([pair in self.path_rows for pair in pairs], index=df.index)
+
+        corners = self._corners(df) if self.bbox is not None else None
+        if corners is not None:
+            lats = pd.concat([pd.to_numeric(df[lat], errors='coerce') for lat, _ in corners], axis=1)
+            lons = pd.concat([pd.to_numeric(df[lon], errors='coerce') for _, lon in corners], axis=1)
+            west, south, east, north = self.bbox
+            keep &= ((lons.max(axis=1) >= west) & (lons.min(axis=1) <= east) &
+                     (lats.max(axis=1) >= south) & (lats.min(axis=1) <= north))
+        return keep
+
+
+def _iter_export_rows(csv_path, columns, export_filter=None):
+    """
+    generator of {column: value} dicts holding only the requested columns present in the export,
+    for the rows which pass the export_filter.
+    """
+    if export_filter is not None:
+        columns = list(columns) + export_filter.columns
+    with _open_export(csv_path) as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        wanted = [(header.index(name), name) for name in columns if name in header]
+        for row in reader:
+            row = {name: row[i] for i, name in wanted if i < len(row)}
+            if export_filter is None or export_filter.matches(row):
+                yield row
+
+
+def _iter_export_rows_pandas(csv_path, columns, export_filter=None, chunksize=100000):
+    """ same as _iter_export_rows, reading with pandas' C parser and filtering a chunk at a time """
+    pd = sys.modules['pandas']
+    if export_filter is not None:
+        columns = list(columns) + export_filter.columns
+    for chunk in pd.read_csv(csv_path, encoding=EXPORT_ENCODING, usecols=lambda c: c in columns,
+                             dtype=str, keep_default_na=False, chunksize=chunksize):
+        if export_filter is not None:
+            chunk = chunk[export_filter.mask(chunk)]
+        for row in chunk.to_dict('records'):
+            yield row
+
+
+def iter_order_inputs_from_earth_explorer_export(csv_path, **filters):
+    """
+    generator of the tile ids in an earth explorer export, read one row at a time so
+    exports of any size can be streamed. Plain and gzipped (.gz) csv files are supported.
+    Only the tile id columns (and columns needed by filters) are parsed. If pandas has
+    already been imported, its faster csv parser is used, but it is never imported just for this.
+
+    :param csv_path:    path to the export
+    :param filters:     keyword arguments for ExportFilter, such as cloud_max=20,
+                        start_date='2016-01-01' or bbox=(west, south, east, north).
+                        Only scenes passing every filter are returned.
+    """
+    export_filter = ExportFilter(**filters) if filters else None
+    if 'pandas' in sys.modules:
+        rows = _iter_export_rows_pandas(csv_path, EXPORT_TILE_COLUMNS, export_filter)
+    else:
+        rows = _iter_export_rows(csv_path, EXPORT_TILE_COLUMNS, export_filter)
+
+    for row in rows:
+        for column, to_tile in EXPORT_TILE_COLUMNS.items():
+            if row.get(column):
+                yield to_tile(row[column])
+
+
+def get_order_inputs_from_earth_explorer_export(csv_path, **filters):
     """
     All the landsat record exports come with the tilename in the first column, so
     this simple function just reads it and returns that whole first column as a list.
+    Accepts the same filters as iter_order_inputs_from_earth_explorer_export.
     """
-    df = pd.read_csv(csv_path, encoding="ISO-8859-1")
-    tiles = []
-    # check for landsat tiles
-    if 'Landsat Scene Identifier' in df.columns.values:
-        tiles += [t for t in list(df['Landsat Scene Identifier']) if t]
-    if 'Local Granule ID' in df.columns.values:
-        tiles += [t.replace(".hdf", "") for t in list(df['Local Granule ID']) if t]
-    return tiles
+    return list(iter_order_inputs_from_earth_explorer_export(csv_path, **filters))
+
+
+def invalid_tiles(tiles, product=None):
+    """
+    returns the list of input tiles which are not valid tile ids, in input order.
+    The whole tile must match, and only tile ids of the products family are accepted
+    (landsat for "olitirs8", "etm7", etc, modis for "mod09a1", etc). If the product is
+    None or not a known landsat or modis product, either family is accepted.
+    """
+    product = product.lower() if product else None
+    if product in LANDSAT_PRODUCTS:
+        fullmatch = _LANDSAT_VALIDATOR.fullmatch
+    elif product in MODIS_PRODUCTS:
+        fullmatch = _MODIS_VALIDATOR.fullmatch
+    else:
+        fullmatch = _ANY_VALIDATOR.fullmatch
+    return [tile for tile in tiles if not fullmatch(tile)]
 
 
 def search_landsat_tiles(string, short=False):
@@ -25,14 +275,14 @@ def search_landsat_tiles(string, short=False):
     tiles = []
     # even if short is False, try short tile spec if long tile produces nothing.
     if not short:
-        long_tiles = re.findall(LANDSAT_TILE_REGEX.lower(), string.lower())
+        long_tiles = LANDSAT_TILE_PATTERN.findall(string)
         if long_tiles:
             tiles = [''.join(chunks).upper() for chunks in long_tiles]
         else:
             short = True
 
     if short:
-        short_tiles = re.findall(LANDSAT_SHORT_REGEX.lower(), string.lower())
+        short_tiles = LANDSAT_SHORT_PATTERN.findall(string)
         if short_tiles:
             tiles = [''.join(chunks).upper() for chunks in short_tiles]
 
@@ -41,7 +291,121 @@ def search_landsat_tiles(string, short=False):
 
 def search_modis_tiles(string):
     """ searches string for modis tiles and returns list of any found """
-    tiles = re.findall(MODIS_TILE_REGEX.lower(), string.lower())
+    tiles = MODIS_TILE_PATTERN.findall(string)
     if tiles:
         tiles = [''.join(chunks).upper() for chunks in tiles]
     return list(set(tiles))
+
+
+class LandsatTile(namedtuple("LandsatTile", ["tile", "sensor", "satellite", "path", "row",
+                                             "year", "doy", "station", "version"])):
+    """
+    parsed landsat tile id. Short tile ids (without station and version) have
+    station and version None. Sort records by (path, row, year, doy) with tile_sort_key.
+    """
+    __slots__ = ()
+
+    @property
+    def date(self):
+        """ acquisition date """
+        return date(self.year, 1, 1) + timedelta(days=self.doy - 1)
+
+    @property
+    def path_row(self):
+        return self.path, self.row
+
+
+class ModisTile(namedtuple("ModisTile", ["tile", "product", "year", "doy", "h", "v",
+                                         "collection", "production"])):
+    """ parsed modis tile id, with the sinusoidal grid tile as h and v """
+    __slots__ = ()
+
+    @property
+    def date(self):
+        """ acquisition date """
+        return date(self.year, 1, 1) + timedelta(days=self.doy - 1)
+
+
+@lru_cache(maxsize=65536)
+def parse_tile(tile):
+    """
+    parses a landsat or modis tile id into a LandsatTile or ModisTile record. The
+    whole string must be a tile id. Results are cached, so parsing the same tile
+    ids again (as orders, downloads and catalogs do) costs a dict lookup.
+    """
+    # the groups of the conf regexes, which also validate and search for tile ids
+    match = LANDSAT_TILE_PATTERN.fullmatch(tile) or LANDSAT_SHORT_PATTERN.fullmatch(tile)
+    if match:
+        _, sensor, satellite, path, row, year_doy, station, version = (match.groups() + (None, None))[:8]
+        return LandsatTile(tile.upper(), sensor.upper(), int(satellite), int(path), int(row),
+                           int(year_doy[:4]), int(year_doy[4:]), station and station.upper(),
+                           int(version) if version else None)
+
+    match = MODIS_TILE_PATTERN.fullmatch(tile)
+    if match:
+        groups = match.groups()
+        year_doy, grid, collection, production = groups[6:]
+        return ModisTile(tile.upper(), "".join(groups[:6]).upper(), int(year_doy[1:5]), int(year_doy[5:]),
+                         int(grid[1:3]), int(grid[4:6]), int(collection), production)
+
+    raise BadTileError("'{0}' is not a landsat or modis tile id".format(tile), invalid=[tile])
+
+
+def parse_tiles(tiles, skip_invalid=False):
+    """
+    parses a list of tile ids into records, in input order. This is a loop over
+    parse_tile, not a vectorized parser: each distinct tile id is parsed once, and
+    ids seen before (in this or earlier calls) come from the parse_tile cache. Raises a BadTileError listing every invalid tile id unless skip_invalid
+    is True, in which case invalid tile ids are left out.
+    """
+    records = {}
+    invalid = []
+    for tile in tiles:
+        if tile not in records:
+            try:
+                records[tile] = parse_tile(tile)
+            except BadTileError:
+                records[tile] = None
+                invalid.append(tile)
+
+    if invalid and not skip_invalid:
+        raise BadTileError("{0} tile(s) are not landsat or modis tile ids: {1}".format(len(invalid), invalid),
+                           invalid=invalid)
+    return [records[tile] for tile in tiles if records[tile] is not None]
+
+
+def tile_sort_key(record):
+    """ sorts landsat records by path, row and date, and modis records by grid tile and date """
+    if isinstance(record, LandsatTile):
+        return record.path, record.row, record.year, record.doy
+    return record.h, record.v, record.year, record.doy
+
+
+def index_rejected_tiles(response):
+    """
+    Walks a (400) api response body once and returns an OrderedDict of every tile id
+    mentioned in it (upper cased) -> the reason it was mentioned. The reason is the message the tile
+    appeared in, or the path of keys leading to it when the message is just the tile,
+    such as "messages > errors > Inputs Not Available > olitirs8".
+    """
+    index = OrderedDict()
+
+    def add(string, reason):
+        for match in _ANY_VALIDATOR.finditer(string):
+            index.setdefault(match.group(0).upper(), reason)
+
+    def walk(node, path):
+        if isinstance(node, dict):
+            for key, value in node.items():
+                key = str(key)
+                add(key, value if isinstance(value, str) else " > ".join(path + [key]))
+                walk(value, path + [key])
+        elif isinstance(node, (list, tuple)):
+            for value in node:
+                walk(value, path)
+        elif isinstance(node, str):
+            reason = " > ".join(path) if _ANY_VALIDATOR.fullmatch(node.strip()) else node
+            add(node, reason)
+
+    walk(response, [])
+    return index
@@ -3,13 +3,26 @@
 # Minor modifications by Jwely@Github
 
 import json
+import os
+import sys
 import time
-import requests
-import geocoder
 import re
+import threading
+from array import array
+from collections import OrderedDict
+from contextlib import closing
+from datetime import date, timedelta
+from functools import partial
+from queue import Queue, Full
+from concurrent.futures import ThreadPoolExecutor
+from espa_api_client.conf import MAX_WORKERS, TIMEOUT, GEOCODE_CACHE_PATH
+from espa_api_client.Exceptions import SearchError
+from espa_api_client.Sessions import get_shared_session, iter_window
 
 
 API_URL = 'https://api.developmentseed.org/landsat'
+PAGE_SIZE = 1000    # results fetched per request by Search.search_all
+MAX_PATH_ROWS = 20  # path/row pairs per query planned by Search.plan_queries
 
 # Geocoding confidence scores,
 # from https://github.com/DenisCarriere/geocoder/blob/master/docs/features/Confidence%20Score.md
@@ -28,7 +41,81 @@ geocode_confidences = {
 }
 
 
-def geocode(address, required_precision_km=1.):
+class GeocodeCache(object):
+    """
+    Persistent record of address -> {'lat', 'lon', 'precision_km'}, saved as json.
+    Addresses are matched ignoring case and extra whitespace. Every geocoded address
+    is written through to the file, and known addresses can be seeded offline, so
+    repeated address searches never need the geocoding service.
+    """
+
+    def __init__(self, path=GEOCODE_CACHE_PATH):
+        """
+        :param path:
+            json file to persist the cache to, loaded if it exists. None keeps it in memory only.
+        :type path:
+            String
+        """
+        self.path = path
+        self.locations = {}
+        self._lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            with open(path, 'r') as f:
+                self.locations = json.loads(f.read())
+
+    @staticmethod
+    def normalize(address):
+        return ' '.join(address.lower().split())
+
+    def get(self, address):
+        """ returns the cached {'lat', 'lon', 'precision_km'} for an address, or None """
+        return self.locations.get(self.normalize(address))
+
+    def put(self, address, lat, lon, precision_km=0.):
+        """ stores the location of one address and saves the cache """
+        self.seed({address: (lat, lon, precision_km)})
+
+    def seed(self, locations):
+        """
+        stores many locations at once and saves the cache.
+        :param locations:
+            dict of address -> (lat, lon) or (lat, lon, precision_km). Locations without
+            a precision are taken as exact.
+        :type locations:
+            dict
+        """
+        with self._lock:
+            for address, location in locations.items():
+                lat, lon, precision_km = (tuple(location) + (0.,))[:3]
+                self.locations[self.normalize(address)] = {'lat': lat, 'lon': lon, 'precision_km': precision_km}
+            self.save()
+        return self
+
+    def save(self):
+        """ saves the cache to json, does nothing if it has no path """
+        if self.path is None:
+            return self
+        head = os.path.dirname(self.path)
+        if head and not os.path.exists(head):
+            os.makedirs(head)
+        with open(self.path + ".tmp", 'w+') as f:
+            f.write(json.dumps(self.locations, indent=2, sort_keys=True))
+        os.replace(self.path + ".tmp", self.path)
+        return self
+
+
+def _lookup(address):
+    """ asks the geocoding service for an address, returns (lat, lon, precision_km) """
+    import geocoder     # only needed for addresses which are not cached
+
+    geocoded = geocoder.google(address)
+    if geocoded.confidence not in geocode_confidences:
+        raise ValueError("Address could not be located")
+    (lon, lat) = geocoded.geometry['coordinates']
+    return lat, lon, geocode_confidences[geocoded.confidence]
+
+
+def geocode(address, required_precision_km=1., cache=None):
     """ Identifies the coordinates of an address
     :param address:
         the address to be geocoded
@@ -38,19 +125,78 @@ def geocode(address, required_precision_km=1.):
         the maximum permissible geographic uncertainty for the geocoding
     :type required_precision_km:
         float
+    :param cache:
+        optional GeocodeCache to look the address up in first, and to store the result in
+    :type cache:
+        GeocodeCache
     :returns:
         dict
     """
-    geocoded = geocoder.google(address)
-    precision_km = geocode_confidences[geocoded.confidence]
+    location = cache.get(address) if cache is not None else None
+    if location is None:
+        lat, lon, precision_km = _lookup(address)
+        if cache is not None:
+            cache.put(address, lat, lon, precision_km)
+    else:
+        lat, lon, precision_km = location['lat'], location['lon'], location['precision_km']
 
     if precision_km <= required_precision_km:
-        (lon, lat) = geocoded.geometry['coordinates']
         return {'lat': lat, 'lon': lon}
     else:
         raise ValueError("Address could not be precisely located")
 
 
+def geocode_many(addresses, required_precision_km=1., cache=None, max_workers=4):
+    """ Identifies the coordinates of many addresses. Duplicate addresses are only
+    looked up once, and addresses missing from the cache are looked up concurrently.
+    :param addresses:
+        the addresses to be geocoded
+    :type addresses:
+        list
+    :param required_precision_km:
+        the maximum permissible geographic uncertainty for the geocoding
+    :type required_precision_km:
+        float
+    :param cache:
+        optional GeocodeCache, defaults to an in memory one
+    :type cache:
+        GeocodeCache
+    :param max_workers:
+        maximum number of concurrent lookups
+    :type max_workers:
+        integer
+    :returns:
+        OrderedDict of address -> {'lat', 'lon'}, or None for addresses which could not be precisely located
+    """
+    if cache is None:
+        cache = GeocodeCache(path=None)
+
+    missing = OrderedDict()
+    for address in addresses:
+        if cache.get(address) is None:
+            missing.setdefault(cache.normalize(address), address)
+
+    if missing:
+        def lookup(address):
+            try:
+                return address, _lookup(address)
+            except ValueError:
+                return address, None
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            found = {address: location for address, location in executor.map(lookup, missing.values())
+                     if location is not None}
+        cache.seed(found)
+
+    results = OrderedDict()
+    for address in addresses:
+        try:
+            results[address] = geocode(address, required_precision_km, cache) if cache.get(address) else None
+        except ValueError:
+            results[address] = None
+    return results
+
+
 def three_digit(number):
     """ Add 0s to inputs that their length is less than 3.
     :param number:
@@ -97,14 +243,195 @@ def create_paired_list(value):
                          'no space)')
 
 
+class SearchResults(object):
+    """ Column oriented collection of search results. Each field is held in one column
+    instead of one dict per scene, and dicts or geojson features are only built when
+    they are asked for. The values the api returned are kept as they are, so views
+    match the output of Search.search() exactly, and cloud cover and dates are also
+    held as typed arrays for filtering. Filters work on whole columns, with numpy if
+    it has already been imported, and return a new SearchResults.
+    :example:
+        results = Search().search_columns('015,033', start_date='2014-01-01')
+        clear = results.filter_cloud(cloud_max=20).filter_dates('2015-01-01', '2015-12-31')
+        for scene in clear:
+            print(scene['sceneID'], scene['cloud'])
+        geojson = clear.geojson()
+    """
+
+    CORNERS = ('upperLeftCorner', 'lowerLeftCorner', 'lowerRightCorner', 'upperRightCorner')
+    COLUMNS = ('scene_ids', 'thumbnails', 'dates', 'paths', 'rows', 'clouds', 'cloud_numbers', 'date_numbers')
+
+    def __init__(self, scenes=()):
+        """
+        :param scenes:
+            optional iterable of scenes as returned by the api, see extend
+        :type scenes:
+            iterable
+        """
+        self.scene_ids = []
+        self.thumbnails = []
+        self.dates = []                 # as returned by the api, 'YYYY-MM-DD'
+        self.paths = []
+        self.rows = []
+        self.clouds = []
+        self.cloud_numbers = array('d')     # cloud cover as floats, nan if missing, for filtering
+        self.date_numbers = array('d')      # dates as YYYYMMDD numbers, nan if malformed, for filtering
+        self.lons = {corner: [] for corner in self.CORNERS}     # None where the api returned no corners
+        self.lats = {corner: [] for corner in self.CORNERS}
+        self.extend(scenes)
+
+    @staticmethod
+    def _number(value):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return float('nan')
+
+    def extend(self, scenes):
+        """ appends scenes (dicts with the api's field names, such as 'sceneID' and 'cloudCoverFull') """
+        for r in scenes:
+            self.scene_ids.append(r['sceneID'])
+            self.thumbnails.append(r['browseURL'])
+            self.dates.append(r['acquisitionDate'])
+            self.paths.append(r['path'])
+            self.rows.append(r['row'])
+            self.clouds.append(r['cloudCoverFull'])
+            self.cloud_numbers.append(self._number(r['cloudCoverFull']))
+            self.date_numbers.append(self._number(str(r['acquisitionDate'])[:10].replace('-', '')))
+            for corner in self.CORNERS:
+                self.lons[corner].append(r.get(corner + 'Longitude'))
+                self.lats[corner].append(r.get(corner + 'Latitude'))
+        return self
+
+    def __len__(self):
+        return len(self.scene_ids)
+
+    def __getitem__(self, i):
+        """ the scene at index i, in the same format as the 'results' of Search.search() """
+        return {'sceneID': self.scene_ids[i],
+                'sat_type': u'L8',
+                'path': three_digit(self.paths[i]),
+                'row': three_digit(self.rows[i]),
+                'thumbnail': self.thumbnails[i],
+                'date': self.dates[i],
+                'cloud': self.clouds[i]}
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def records(self):
+        """ list of every scene, see __getitem__ """
+        return list(self)
+
+    def feature(self, i):
+        """ the scene at index i as a geojson feature, raises KeyError if the api returned no corners for it """
+        ring = []
+        for corner in self.CORNERS:
+            if self.lons[corner][i] is None or self.lats[corner][i] is None:
+                raise KeyError(corner + ('Longitude' if self.lons[corner][i] is None else 'Latitude'))
+            ring.append([self.lons[corner][i], self.lats[corner][i]])
+        return {
+            'type': 'Feature',
+            'properties': {
+                'sceneID': self.scene_ids[i],
+                'row': three_digit(self.rows[i]),
+                'path': three_digit(self.paths[i]),
+                'thumbnail': self.thumbnails[i],
+                'date': self.dates[i],
+                'cloud': self.clouds[i]
+            },
+            'geometry': {
+                'type': 'Polygon',
+                'coordinates': [ring + [ring[0]]]
+            }
+        }
+
+    def iter_features(self):
+        """ generator of every scene as a geojson feature """
+        for i in range(len(self)):
+            yield self.feature(i)
+
+    def geojson(self):
+        """ geojson FeatureCollection of every scene, as returned by Search.search(geojson=True) """
+        return {'type': 'FeatureCollection', 'features': list(self.iter_features())}
+
+    def take(self, indices):
+        """ new SearchResults holding the scenes at the input indices, in that order """
+        taken = SearchResults()
+        for name in self.COLUMNS:
+            column = getattr(self, name)
+            getattr(taken, name).extend(column[i] for i in indices)
+        for corner in self.CORNERS:
+            taken.lons[corner].extend(self.lons[corner][i] for i in indices)
+            taken.lats[corner].extend(self.lats[corner][i] for i in indices)
+        return taken
+
+    @staticmethod
+    def _between(column, low, high):
+        """
+        indices of the values in an array column which are within [low, high], either may
+        be None. nan values only pass when there are no bounds at all.
+        """
+        np = sys.modules.get('numpy')
+        if np is not None:
+            values = np.frombuffer(column, dtype=column.typecode) if len(column) else np.empty(0)
+            keep = np.ones(len(values), dtype=bool)
+            if low is not None:
+                keep &= values >= low
+            if high is not None:
+                keep &= values <= high
+            return np.flatnonzero(keep).tolist()
+        return [i for i, value in enumerate(column)
+                if (low is None or value >= low) and (high is None or value <= high)]
+
+    def filter_cloud(self, cloud_min=None, cloud_max=None):
+        """ scenes with a cloud cover percentage within [cloud_min, cloud_max] """
+        return self.take(self._between(self.cloud_numbers, cloud_min, cloud_max))
+
+    def filter_dates(self, start_date=None, end_date=None):
+        """ scenes acquired within [start_date, end_date], given as 'YYYY-MM-DD' strings """
+        def number(date_string):
+            return int(date_string[:10].replace('-', '')) if date_string else None
+        return self.take(self._between(self.date_numbers, number(start_date), number(end_date)))
+
+
 class Search(object):
     """ The search class """
 
-    def __init__(self):
+    def __init__(self, session=None, max_workers=MAX_WORKERS, timeout=TIMEOUT, cache=None, geocode_cache=None):
+        """
+        :param session:
+            optional requests.Session to send requests with, defaults to the shared pooled session
+        :type session:
+            requests.Session
+        :param max_workers:
+            maximum number of pages search_all fetches at once
+        :type max_workers:
+            integer
+        :param timeout:
+            (connect, read) timeout in seconds for each request
+        :type timeout:
+            tuple
+        :param cache:
+            optional SearchCache instance. When given, responses are looked up in it
+            before sending a request, and stored in it afterwards.
+        :type cache:
+            SearchCache
+        :param geocode_cache:
+            optional GeocodeCache used to locate addresses
+        :type geocode_cache:
+            GeocodeCache
+        """
         self.api_url = API_URL
+        self.session = session if session is not None else get_shared_session()
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.cache = cache
+        self.geocode_cache = geocode_cache
 
     def search(self, paths_rows=None, lat=None, lon=None, address=None, start_date=None, end_date=None, cloud_min=None,
-               cloud_max=None, limit=1, geojson=False):
+               cloud_max=None, limit=1, geojson=False, max_path_rows=MAX_PATH_ROWS):
         """
         The main method of Search class. It searches Development Seed's Landsat API.
         :param paths_rows:
@@ -147,6 +474,12 @@ class Search(object):
             boolean specifying whether to return a geojson object
         :type geojson:
             boolean
+        :param max_path_rows:
+            searches for more path/row pairs than this are split into concurrent queries of
+            at most max_path_rows pairs each (see plan_queries), whose results are merged
+            up to the limit, instead of sending one very long url.
+        :type max_path_rows:
+            integer
         :returns:
             dict
         :example:
@@ -171,14 +504,12 @@ class Search(object):
             }
         """
 
-        search_string = self.query_builder(paths_rows, lat, lon, address, start_date, end_date, cloud_min, cloud_max)
-
-        # Have to manually build the URI to bypass requests URI encoding
-        # The api server doesn't accept encoded URIs
-
-        r = requests.get('%s?search=%s&limit=%s' % (self.api_url, search_string, limit))
-
-        r_dict = json.loads(r.text)
+        queries = self.plan_queries(paths_rows, lat, lon, address, start_date, end_date, cloud_min, cloud_max,
+                                    max_path_rows)
+        if len(queries) == 1:
+            r_dict = self._get_page(queries[0], limit)
+        else:
+            r_dict = self._get_merged_page(queries, limit)
         result = {}
 
         if 'error' in r_dict:
@@ -187,54 +518,230 @@ class Search(object):
             result['message'] = r_dict['error']['message']
 
         elif 'meta' in r_dict:
+            results = SearchResults(r_dict['results'])
             if geojson:
-                result = {
-                    'type': 'FeatureCollection',
-                    'features': []
-                }
-                for r in r_dict['results']:
-                    feature = {
-                        'type': 'Feature',
-                        'properties': {
-                            'sceneID': r['sceneID'],
-                            'row': three_digit(r['row']),
-                            'path': three_digit(r['path']),
-                            'thumbnail': r['browseURL'],
-                            'date': r['acquisitionDate'],
-                            'cloud': r['cloudCoverFull']
-                        },
-                        'geometry': {
-                            'type': 'Polygon',
-                            'coordinates': [
-                                [
-                                    [r['upperLeftCornerLongitude'], r['upperLeftCornerLatitude']],
-                                    [r['lowerLeftCornerLongitude'], r['lowerLeftCornerLatitude']],
-                                    [r['lowerRightCornerLongitude'], r['lowerRightCornerLatitude']],
-                                    [r['upperRightCornerLongitude'], r['upperRightCornerLatitude']],
-                                    [r['upperLeftCornerLongitude'], r['upperLeftCornerLatitude']]
-                                ]
-                            ]
-                        }
-                    }
-
-                    result['features'].append(feature)
+                result = results.geojson()
 
             else:
                 result['status'] = u'SUCCESS'
                 result['total'] = r_dict['meta']['results']['total']
                 result['limit'] = r_dict['meta']['results']['limit']
-                result['total_returned'] = len(r_dict['results'])
-                result['results'] = [{'sceneID': i['sceneID'],
-                                      'sat_type': u'L8',
-                                      'path': three_digit(i['path']),
-                                      'row': three_digit(i['row']),
-                                      'thumbnail': i['browseURL'],
-                                      'date': i['acquisitionDate'],
-                                      'cloud': i['cloudCoverFull']}
-                                     for i in r_dict['results']]
+                result['total_returned'] = len(results)
+                result['results'] = results.records()
 
         return result
 
+    def _get_merged_page(self, queries, limit):
+        """
+        requests the first page of each query concurrently, and merges them into one
+        response as _get_page returns it, holding at most limit scenes (each sceneID once).
+        Any error other than finding no matches is returned as is.
+        """
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(queries))) as executor:
+            pages = list(executor.map(lambda search_string: self._get_page(search_string, limit), queries))
+
+        found = [page for page in pages if 'meta' in page]
+        errors = [page for page in pages if 'error' in page]
+        failed = [page for page in errors if page['error'].get('code') != 'NOT_FOUND']
+        if failed or not found:
+            return (failed or errors or pages)[0]
+
+        results = OrderedDict()
+        for page in found:
+            for scene in page['results']:
+                results.setdefault(scene['sceneID'], scene)
+        return {'meta': {'results': {'total': sum(page['meta']['results']['total'] for page in found),
+                                     'limit': limit}},
+                'results': list(results.values())[:limit]}
+
+    def search_all(self, paths_rows=None, lat=None, lon=None, address=None, start_date=None, end_date=None,
+                   cloud_min=None, cloud_max=None, page_size=PAGE_SIZE, max_workers=None,
+                   max_path_rows=MAX_PATH_ROWS, max_days=None):
+        """
+        Generator of every scene matching the query, in the same format as the 'results'
+        of search(). The query is first split into sub-queries by plan_queries(). Each
+        sub-query's first page reports its total number of matches, and the remaining
+        pages are then fetched concurrently with at most max_workers requests in flight.
+        Scenes are yielded in order, each sceneID once, and nothing further is fetched
+        once the caller stops iterating.
+        :param page_size:
+            number of results fetched per request
+        :type page_size:
+            integer
+        :param max_workers:
+            number of concurrent requests, defaults to self.max_workers
+        :type max_workers:
+            integer
+        :param max_path_rows:
+            maximum number of path/row pairs per sub-query
+        :type max_path_rows:
+            integer
+        :param max_days:
+            optional maximum number of days in the date range of each sub-query
+        :type max_days:
+            integer
+        :raises SearchError:
+            if the api returns an error other than finding no matches
+        :example:
+            s = Search()
+            for scene in s.search_all('015,033', start_date='2014-01-01', end_date='2016-12-31'):
+                print(scene['sceneID'])
+        """
+        for page in self._iter_unique_pages(paths_rows, lat, lon, address, start_date, end_date, cloud_min,
+                                            cloud_max, page_size, max_workers, max_path_rows, max_days):
+            for scene in SearchResults(page):
+                yield scene
+
+    def search_columns(self, paths_rows=None, lat=None, lon=None, address=None, start_date=None, end_date=None,
+                       cloud_min=None, cloud_max=None, page_size=PAGE_SIZE, max_workers=None,
+                       max_path_rows=MAX_PATH_ROWS, max_days=None):
+        """
+        Same as search_all, but collects every scene into a column oriented SearchResults,
+        which holds large result sets compactly and can be filtered or turned into geojson.
+        :returns:
+            SearchResults
+        """
+        results = SearchResults()
+        for page in self._iter_unique_pages(paths_rows, lat, lon, address, start_date, end_date, cloud_min,
+                                            cloud_max, page_size, max_workers, max_path_rows, max_days):
+            results.extend(page)
+        return results
+
+    def _iter_unique_pages(self, paths_rows, lat, lon, address, start_date, end_date, cloud_min, cloud_max,
+                           page_size, max_workers, max_path_rows, max_days):
+        """ generator of the scenes matching the query as returned by the api, a page at a time, each sceneID once """
+        if max_workers is None:
+            max_workers = self.max_workers
+        queries = self.plan_queries(paths_rows, lat, lon, address, start_date, end_date, cloud_min, cloud_max,
+                                    max_path_rows, max_days)
+
+        seen = set()
+        if len(queries) == 1:
+            pages = self._iter_pages(queries[0], page_size, max_workers)
+        else:
+            pages = self._iter_queries(queries, page_size, max_workers)
+        for page in pages:
+            unique = [scene for scene in page if scene['sceneID'] not in seen]
+            seen.update(scene['sceneID'] for scene in unique)
+            yield unique
+
+    def plan_queries(self, paths_rows=None, lat=None, lon=None, address=None, start_date=None, end_date=None,
+                     cloud_min=None, cloud_max=None, max_path_rows=MAX_PATH_ROWS, max_days=None):
+        """
+        Splits a search into query strings with at most max_path_rows path/row pairs and,
+        if max_days is given, date ranges of at most max_days days each. An address is
+        geocoded once for all of them.
+        :returns:
+            list of query strings, as built by query_builder
+        """
+        if address:
+            location = geocode(address, cache=self.geocode_cache)
+            lat, lon, address = location['lat'], location['lon'], None
+
+        pair_chunks = [None]
+        if paths_rows:
+            pairs = list(OrderedDict.fromkeys(tuple(pair) for pair in create_paired_list(paths_rows)))
+            pair_chunks = [','.join(','.join(pair) for pair in pairs[i:i + max_path_rows])
+                           for i in range(0, len(pairs), max_path_rows)]
+
+        date_ranges = [(start_date, end_date)]
+        if max_days and (start_date or end_date):
+            start = date(*map(int, (start_date or '2009-01-01').split('-')))
+            end = date(*map(int, end_date.split('-'))) if end_date else date.today()
+            date_ranges = []
+            while start <= end:
+                window_end = min(start + timedelta(days=max_days - 1), end)
+                date_ranges.append((start.isoformat(), window_end.isoformat()))
+                start = window_end + timedelta(days=1)
+
+        return [self.query_builder(pairs, lat, lon, address, start, end, cloud_min, cloud_max)
+                for pairs in pair_chunks for start, end in date_ranges]
+
+    def _iter_pages(self, search_string, page_size, max_workers):
+        """ generator of the list of scenes on each page of one query, in order """
+        page = self._check_page(self._get_page(search_string, page_size))
+        yield page['results']
+        if not page['results']:
+            return
+
+        skips = range(page_size, page['meta']['results']['total'], page_size)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            with closing(iter_window(skips, partial(executor.submit, self._get_page, search_string, page_size),
+                                     max_workers)) as window:
+                for _, future in window:
+                    yield self._check_page(future.result())['results']
+
+    def _iter_queries(self, queries, page_size, max_workers, queue_size=2):
+        """
+        generator of the list of scenes on each page of many queries, in query order. Up to
+        max_workers queries run at once, each paging through its results one request at a
+        time and handing pages over through a queue of at most queue_size pages, so pages
+        stream out as they arrive and only a few pages per query are held in memory.
+        """
+        stop = threading.Event()
+        done = object()     # marks the end of a query's pages
+
+        def run(search_string, pages):
+            def put(item):
+                while not stop.is_set():
+                    try:
+                        pages.put(item, timeout=0.1)
+                        return True
+                    except Full:
+                        pass
+                return False
+
+            try:
+                for page in self._iter_pages(search_string, page_size, 1):
+                    if not put(page):
+                        return
+            except Exception as e:
+                put(e)
+                return
+            put(done)
+
+        queries = ((search_string, Queue(maxsize=queue_size)) for search_string in queries)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            try:
+                with closing(iter_window(queries, lambda query: executor.submit(run, *query), max_workers)) as window:
+                    for (_, pages), _ in window:
+                        while True:
+                            page = pages.get()
+                            if page is done:
+                                break
+                            if isinstance(page, Exception):
+                                raise page
+                            yield page
+            finally:
+                stop.set()
+
+    def _get_page(self, search_string, limit, skip=0):
+        """ requests one page of results, returns the parsed json response """
+        if self.cache is not None:
+            cached = self.cache.get(search_string, limit, skip)
+            if cached is not None:
+                return cached
+
+        # Have to manually build the URI to bypass requests URI encoding
+        # The api server doesn't accept encoded URIs
+        url = '%s?search=%s&limit=%s' % (self.api_url, search_string, limit)
+        if skip:
+            url += '&skip=%s' % skip
+        r = self.session.get(url, timeout=self.timeout)
+        r_dict = json.loads(r.text)
+        if self.cache is not None and 'meta' in r_dict:  # errors are not cached
+            self.cache.put(search_string, limit, r_dict, skip)
+        return r_dict
+
+    @staticmethod
+    def _check_page(r_dict):
+        """ returns a page response with 'results' and 'meta', raising SearchError for api errors """
+        if 'error' in r_dict:
+            if r_dict['error'].get('code') == 'NOT_FOUND':
+                return {'meta': {'results': {'total': 0}}, 'results': []}
+            raise SearchError("{0}: {1}".format(r_dict['error'].get('code'), r_dict['error'].get('message')))
+        return r_dict
+
     def query_builder(self, paths_rows=None, lat=None, lon=None, address=None, start_date=None, end_date=None,
                       cloud_min=None, cloud_max=None):
         """ Builds the proper search syntax (query) for Landsat API.
@@ -377,7 +884,7 @@ class Search(object):
         :returns:
             String
         """
-        geocoded = geocode(address)
+        geocoded = geocode(address, cache=self.geocode_cache)
         return self.lat_lon_builder(**geocoded)
 
     @staticmethod
@@ -77,7 +77,7 @@ setup(
     # your project is installed. For an analysis of "install_requires" vs pip's
     # requirements files see:
     # https://packaging.python.org/en/latest/requirements.html
-    install_requires=['requests', 'wget', 'pandas'],
+    install_requires=['requests', 'simplejson'],
 
     # List additional groups of dependencies here (e.g. development
     # dependencies). You can install these using the following syntax,
@@ -86,6 +86,7 @@ setup(
     extras_require={
         'dev': [],
         'test': [],
+        'async': ['aiohttp'],
     },
 
     # If there are data files included in your packages that need to be